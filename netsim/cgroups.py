@@ -0,0 +1,167 @@
+import os
+import time
+
+from mininet.log import error
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_v2_available(root=CGROUP_ROOT):
+    return os.path.exists(os.path.join(root, "cgroup.controllers"))
+
+
+def cpu_list(cpus):
+    """Format cpu ids as a cpuset list, e.g. [0, 1, 2, 5] -> "0-2,5"."""
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def partition_cpus(cpus, slots):
+    """Split cpus into `slots` disjoint contiguous chunks.
+
+    Leftover cores go to the first slots. With more slots than cores,
+    slots have to share cores and wrap around."""
+    cpus = sorted(cpus)
+    if slots > len(cpus):
+        error(
+            f"Only {len(cpus)} cores for {slots} runner slots, "
+            f"runner cpusets will overlap\n"
+        )
+        return [[cpus[i % len(cpus)]] for i in range(slots)]
+    size, extra = divmod(len(cpus), slots)
+    chunks, start = [], 0
+    for i in range(slots):
+        end = start + size + (1 if i < extra else 0)
+        chunks.append(cpus[start:end])
+        start = end
+    return chunks
+
+
+def write(path, value):
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def read(path):
+    with open(path, "r") as f:
+        return f.read().strip()
+
+
+def wait_empty(path, timeout=1.0):
+    "Wait until no process is left in the cgroup at path"
+    deadline = time.monotonic() + timeout
+    while "populated 1" in read(os.path.join(path, "cgroup.events")):
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.02)
+
+
+class RunnerCgroups:
+    """cgroup v2 groups for runner slots and the node processes they start.
+
+    Groups live under <root>/netsim-<pid>/r<runner id>/<node name>. Node
+    processes run in their own leaf group, which accounts their CPU time
+    and peak memory. With cpuset=True every runner gets a disjoint share
+    of the cores this process may run on, and with memory_max a
+    memory.max limit, both inherited by its node groups."""
+
+    def __init__(self, slots, cpuset=False, memory_max=None, root=CGROUP_ROOT):
+        if not cgroup_v2_available(root):
+            raise RuntimeError(f"cgroup v2 is not mounted at {root}")
+        self.cpuset = cpuset
+        self.memory_max = memory_max
+        self.base = os.path.join(root, f"netsim-{os.getpid()}")
+        controllers = ["memory"] + (["cpuset"] if cpuset else [])
+        self.enable(root, controllers)
+        os.makedirs(self.base, exist_ok=True)
+        self.enable(self.base, controllers)
+
+        self.nodes = {}
+        chunks = partition_cpus(os.sched_getaffinity(0), slots) if cpuset else []
+        for runner_id in range(slots):
+            path = self.path(runner_id)
+            os.makedirs(path, exist_ok=True)
+            if cpuset:
+                write(os.path.join(path, "cpuset.cpus"), cpu_list(chunks[runner_id]))
+            if memory_max:
+                write(os.path.join(path, "memory.max"), str(memory_max))
+            # memory.peak of the node groups needs the controller below us
+            self.enable(path, ["memory"])
+            self.nodes[runner_id] = set()
+
+    @staticmethod
+    def enable(path, controllers):
+        available = read(os.path.join(path, "cgroup.controllers")).split()
+        missing = [c for c in controllers if c not in available]
+        if missing:
+            raise RuntimeError(
+                f"cgroup controllers {', '.join(missing)} not available in {path}"
+            )
+        write(
+            os.path.join(path, "cgroup.subtree_control"),
+            " ".join("+" + c for c in controllers),
+        )
+
+    def path(self, runner_id, node_name=None):
+        path = os.path.join(self.base, f"r{runner_id}")
+        return os.path.join(path, node_name) if node_name else path
+
+    def node_procs(self, runner_id, node_name):
+        """Create the node's group and return its cgroup.procs path."""
+        path = self.path(runner_id, node_name)
+        os.makedirs(path, exist_ok=True)
+        self.nodes[runner_id].add(node_name)
+        return os.path.join(path, "cgroup.procs")
+
+    def node_usage(self, runner_id, node_name):
+        """CPU time (usec) and peak memory (bytes) of a node's processes."""
+        path = self.path(runner_id, node_name)
+        stats = dict(
+            line.split() for line in read(os.path.join(path, "cpu.stat")).splitlines()
+        )
+        usage = {
+            key: int(stats[key])
+            for key in ("usage_usec", "user_usec", "system_usec")
+            if key in stats
+        }
+        peak = os.path.join(path, "memory.peak")
+        if os.path.exists(peak):
+            usage["memory_peak"] = int(read(peak))
+        return usage
+
+    def allocation(self, runner_id):
+        """What a runner slot was given, for its reports."""
+        path = self.path(runner_id)
+        allocation = {"cgroup": path, "memory_max": self.memory_max}
+        # cpuset.* files only exist with the cpuset controller enabled
+        if self.cpuset:
+            allocation["cpus"] = read(os.path.join(path, "cpuset.cpus.effective"))
+        return allocation
+
+    @staticmethod
+    def remove(path):
+        kill = os.path.join(path, "cgroup.kill")
+        if os.path.exists(kill):
+            write(kill, "1")
+            wait_empty(path)
+        try:
+            os.rmdir(path)
+        except OSError as e:
+            error(f"Could not remove cgroup {path}: {e}\n")
+
+    def release(self, runner_id):
+        """Kill what is left of a case's node processes and drop their groups."""
+        for node_name in self.nodes[runner_id]:
+            self.remove(self.path(runner_id, node_name))
+        self.nodes[runner_id] = set()
+
+    def close(self):
+        for runner_id in self.nodes:
+            self.release(runner_id)
+            self.remove(self.path(runner_id))
+        self.remove(self.base)
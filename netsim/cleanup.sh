@@ -15,4 +15,11 @@ for link in $links; do
     echo "Deleting $link"
     # Example command: sudo ip link delete $link
     sudo ip link delete $link
-done
\ No newline at end of file
+done
+# bridges left behind by the netns backend and the bridge switch backends
+echo "Cleaning up bridges"
+bridges=$(ip -o link show type bridge | egrep -o '(s1-r|ns[[:alnum:]_]+r)[[:digit:]]+')
+for bridge in $bridges; do
+    echo "Deleting $bridge"
+    sudo ip link delete $bridge
+done
@@ -1,24 +1,60 @@
 import argparse
 import concurrent.futures
 import glob
+import heapq
 import json
 import os
+import select
 import sys
 import tempfile
 import time
+from functools import partial
 
 from mininet.log import setLogLevel, info, error
 from mininet.net import Mininet
 
-from net.link import TCLink
-from net.network import StarTopo
-from parsing.netsim import process_logs, process_integration_logs
+from cgroups import RunnerCgroups
+from net.link import TCBatch, TCLink
+from net.netns import NetnsNet, netnsSupported
+from net.network import (
+    DEFAULT_SWITCH,
+    linkDirections,
+    StarTopo,
+    startMulticast,
+    switchBackend,
+    validateLink,
+    validateLinkChange,
+)
+from net.pool import TopologyPool
+from net.trace import TraceReplayer, traceTargets
+from parsing.netsim import process_logs, process_integration_logs, record_ceiling
+from readiness import DEFAULT_READY_TIMEOUT, validate_probe, wait_ready
 import json as json_module
-from sniffer.sniff import Sniffer
+from sampler import IntfSampler, ProcSampler
+from scheduler import (
+    CaseScheduler,
+    case_cpu,
+    case_duration,
+    load_history,
+    record_duration,
+    save_history,
+)
+from sniffer.bpf import captureFilter
+from sniffer.pcap import FORMATS
+from sniffer.sniff import HOST_TYPES, Sniffer
+from sniffer.windows import CaptureTriggers, validateWindows
 from sniffer.process import run_viz
-from util import cleanup_tmp_dirs, eject, FAILED_TESTS, write_failure_summary
+from util import (
+    cleanup_tmp_dirs,
+    eject,
+    FAILED_TESTS,
+    FileWatcher,
+    LogTailer,
+    write_failure_summary,
+)
 
 TIMEOUT = 60 * 5
+REACHABILITY_TIMEOUT = 2
 
 
 def configure_multi_nat_hosts(net, nodes, runner_id):
@@ -78,6 +114,19 @@ def execute_action(net, node_name, action, runner_id):
             n.cmd(f"ip addr add {new_ip} dev {intfs[intf_idx]}")
             info(f"ACTION [{node_name}]: Changed {intfs[intf_idx]} IP to {new_ip}\n")
 
+    elif action_type == "set_link":
+        # Change shaping of a live link in place, per direction like the
+        # node's "link" block ("up" leaves the node, "down" arrives at it)
+        intf_idx = action.get("interface", 0)
+        if intf_idx < len(intfs):
+            intf = n.intf(intfs[intf_idx])
+            up, down = linkDirections(action)
+            peer = intf.link.intf2 if intf.link.intf1 is intf else intf.link.intf1
+            for end, params in ((intf, up), (peer, down)):
+                if params and hasattr(end, "changeShaping"):
+                    end.changeShaping(**params)
+            info(f"ACTION [{node_name}]: Changed link {intfs[intf_idx]} up={up} down={down}\n")
+
 
 def schedule_actions(net, nodes, runner_id):
     """Return list of (delay, node_name, action) tuples sorted by delay."""
@@ -109,69 +158,87 @@ def setup_env_vars(prefix, node_name, temp_dir, node_env, debug=False):
     return env_vars
 
 
+def extract_node_params(parser_type, lines):
+    """Return the parameters found in lines for the given parser, or None."""
+    for idx, line in enumerate(lines):
+        if parser_type == "iroh_ticket" and line.startswith("All-in-one ticket"):
+            return line[len("All-in-one ticket: "):].strip()
+        # DEPRECATED: use iroh_endpoint_json instead
+        if parser_type == "iroh_endpoint_with_addrs" and line.startswith("Endpoint id:"):
+            if idx + 1 >= len(lines):
+                return None
+            endpoint_id = lines[idx + 1].strip()
+            direct_addrs = []
+            j = idx + 2
+            if j < len(lines) and lines[j].startswith("Direct addresses:"):
+                j += 1
+                while j < len(lines) and lines[j].startswith("\t"):
+                    direct_addrs.append(lines[j].strip())
+                    j += 1
+            return {
+                "endpoint_id": endpoint_id,
+                "direct_addrs": direct_addrs
+            }
+        if parser_type == "iroh_endpoint_json":
+            try:
+                data = json.loads(line.strip())
+                if data.get("kind") == "EndpointBound":
+                    return {
+                        "endpoint_id": data["endpoint_id"],
+                        "direct_addrs": data.get("direct_addresses", [])
+                    }
+            except (json.JSONDecodeError, AttributeError):
+                continue
+    return None
+
+
+def pending_param_lines(parser_type, lines):
+    """Lines that must be kept around because a multi-line match may be incomplete."""
+    if parser_type != "iroh_endpoint_with_addrs":
+        return []
+    for idx in range(len(lines) - 1, -1, -1):
+        if lines[idx].startswith("Endpoint id:"):
+            return lines[idx:]
+    return []
+
+
 def parse_node_params(node, prefix, node_params, runner_id):
-    """Parse parameters from node logs with validation using fast polling."""
+    """Parse parameters from node logs, tailing only newly written log data."""
     parsed_params = {}
     max_wait = node.get("wait", 1)
     parser_type = node["param_parser"]
-    poll_interval = 0.2
 
     expected_nodes = [
         f'{node["name"]}_{i}_r{runner_id}'
         for i in range(int(node["count"]))
     ]
+    log_files = {n: f"logs/{prefix}__{n}.txt" for n in expected_nodes}
+    tailers = {n: LogTailer(path) for n, path in log_files.items()}
+    pending = {n: [] for n in expected_nodes}
+    watcher = FileWatcher(log_files.values())
+
+    deadline = time.monotonic() + max_wait
+    try:
+        while True:
+            for node_name in expected_nodes:
+                if node_name in parsed_params:
+                    continue
+                try:
+                    lines = pending[node_name] + tailers[node_name].read_lines()
+                    params = extract_node_params(parser_type, lines)
+                    if params is not None:
+                        parsed_params[node_name] = params
+                    else:
+                        pending[node_name] = pending_param_lines(parser_type, lines)
+                except Exception as e:
+                    error(f"Error parsing parameters from {log_files[node_name]}: {e}")
 
-    max_iterations = max(1, int(max_wait / poll_interval))
-    for iteration in range(max_iterations):
-        for node_name in expected_nodes:
-            if node_name in parsed_params:
-                continue
-
-            log_file = f"logs/{prefix}__{node_name}.txt"
-            if not os.path.exists(log_file):
-                continue
-
-            try:
-                with open(log_file, "r") as f:
-                    lines = f.readlines()
-                    for idx, line in enumerate(lines):
-                        if parser_type == "iroh_ticket" and line.startswith("All-in-one ticket"):
-                            parsed_params[node_name] = line[len("All-in-one ticket: "):].strip()
-                            break
-                        # DEPRECATED: use iroh_endpoint_json instead
-                        if parser_type == "iroh_endpoint_with_addrs" and line.startswith("Endpoint id:"):
-                            if idx + 1 >= len(lines):
-                                break
-                            endpoint_id = lines[idx + 1].strip()
-                            direct_addrs = []
-                            j = idx + 2
-                            if j < len(lines) and lines[j].startswith("Direct addresses:"):
-                                j += 1
-                                while j < len(lines) and lines[j].startswith("\t"):
-                                    direct_addrs.append(lines[j].strip())
-                                    j += 1
-                            parsed_params[node_name] = {
-                                "endpoint_id": endpoint_id,
-                                "direct_addrs": direct_addrs
-                            }
-                            break
-                        if parser_type == "iroh_endpoint_json":
-                            try:
-                                data = json.loads(line.strip())
-                                if data.get("kind") == "EndpointBound":
-                                    parsed_params[node_name] = {
-                                        "endpoint_id": data["endpoint_id"],
-                                        "direct_addrs": data.get("direct_addresses", [])
-                                    }
-                                    break
-                            except json.JSONDecodeError:
-                                continue
-            except Exception as e:
-                error(f"Error parsing parameters from {log_file}: {e}")
-
-        if all(n in parsed_params for n in expected_nodes):
-            break
-        time.sleep(poll_interval)
+            remaining = deadline - time.monotonic()
+            if all(n in parsed_params for n in expected_nodes) or remaining <= 0:
+                break
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
 
     missing_params = [n for n in expected_nodes if n not in parsed_params]
     if missing_params:
@@ -200,30 +267,86 @@ def terminate_processes(p_box, prefix):
             p.kill()
 
 
-def monitor_short_processes(p_short_box, prefix, net=None, scheduled_actions=None, runner_id=0):
-    """Monitor short-lived processes with timeout and detailed error reporting."""
+def open_pidfd(p):
+    """Return a pidfd that becomes readable when p exits, or None if unsupported."""
+    try:
+        return os.pidfd_open(p.pid)
+    except (AttributeError, OSError):
+        return None
+
+
+def monitor_short_processes(
+    p_short_box, prefix, net=None, scheduled_actions=None, runner_id=0, on_action=None
+):
+    """Supervise short-lived processes and fire scheduled actions on time.
+
+    Waits on pidfds for child exit and on a timer heap for the next action
+    instead of polling, so completion is noticed as soon as it happens and
+    actions fire at their scheduled offset. on_action(node_name, action) is
+    called as each action fires. Returns the process errors and a log of
+    when each action actually fired."""
     process_errors = []
-    start_time = time.time()
-    scheduled_actions = scheduled_actions or []
-    executed_actions = set()
-
-    # Monitor processes until all complete or timeout (poll every 200ms)
-    max_polls = TIMEOUT * 5
-    for _ in range(max_polls):
-        elapsed = time.time() - start_time
-
-        # Execute any scheduled actions whose delay has passed
-        for idx, (delay, node_name, action) in enumerate(scheduled_actions):
-            if idx not in executed_actions and elapsed >= delay:
+    fired_actions = []
+    start_time = time.monotonic()
+    deadline = start_time + TIMEOUT
+
+    timers = [
+        (delay, idx, node_name, action)
+        for idx, (delay, node_name, action) in enumerate(scheduled_actions or [])
+    ]
+    heapq.heapify(timers)
+
+    pidfds = {}
+    for _, p, _ in p_short_box:
+        fd = open_pidfd(p)
+        if fd is not None:
+            pidfds[fd] = p
+    # Processes we could not get a pidfd for are checked at a fine interval
+    fallback_poll = None if len(pidfds) == len(p_short_box) else 0.01
+
+    try:
+        while True:
+            now = time.monotonic()
+            while timers and now >= start_time + timers[0][0]:
+                delay, _, node_name, action = heapq.heappop(timers)
+                fired_at = time.monotonic() - start_time
+                if on_action:
+                    on_action(node_name, action)
                 if net:
                     execute_action(net, node_name, action, runner_id)
-                executed_actions.add(idx)
-
-        if not any(p.poll() is None for (_, p, _) in p_short_box):
-            break
-        time.sleep(0.2)
-
-    elapsed_time = time.time() - start_time
+                done_at = time.monotonic() - start_time
+                fired_actions.append({
+                    "node": node_name,
+                    "action": action["action"],
+                    "params": {
+                        k: v for k, v in action.items() if k not in ("action", "delay")
+                    },
+                    "scheduled": delay,
+                    "fired": round(fired_at, 6),
+                    "completed": round(done_at, 6),
+                    "lateness_ms": round((fired_at - delay) * 1000, 3),
+                    "timestamp": time.time(),
+                })
+                now = time.monotonic()
+
+            if not any(p.poll() is None for (_, p, _) in p_short_box):
+                break
+            if now >= deadline:
+                break
+
+            wake = start_time + timers[0][0] if timers else deadline
+            timeout = min(wake, deadline) - now
+            if fallback_poll is not None:
+                timeout = min(timeout, fallback_poll)
+            ready, _, _ = select.select(list(pidfds), [], [], max(0.0, timeout))
+            for fd in ready:
+                del pidfds[fd]
+                os.close(fd)
+    finally:
+        for fd in pidfds:
+            os.close(fd)
+
+    elapsed_time = time.monotonic() - start_time
 
     # Check results and handle timeouts
     for node_name, p, cmd in p_short_box:
@@ -253,7 +376,7 @@ def monitor_short_processes(p_short_box, prefix, net=None, scheduled_actions=Non
                 f"Check log: {log_file}"
             )
 
-    return process_errors
+    return process_errors, fired_actions
 
 
 def handle_connection_strategy(node, node_counts, i, runner_id, node_ips, node_params):
@@ -335,11 +458,15 @@ def handle_connection_strategy(node, node_counts, i, runner_id, node_ips, node_p
     return cmd
 
 
-def execute_node_command(cmd, prefix, node_name, n, env_vars):
+def execute_node_command(cmd, prefix, node_name, n, env_vars, cgroup_procs=None):
     log_path = f"logs/{prefix}__{node_name}.txt"
     with open(log_path, "w+") as f:
         f.write(f"cmd: {cmd}\n\n")
         f.flush()
+        if cgroup_procs:
+            # The shell joins the cgroup before it starts the command, so
+            # everything the command forks is accounted there too
+            cmd = f"echo $$ > {cgroup_procs}; {cmd}"
         return n.popen(cmd, stdout=f, stderr=f, shell=True, env=env_vars)
 
 
@@ -353,12 +480,70 @@ def get_node_ips(net, nodes, runner_id):
     return node_ips
 
 
-def prep_net(net, nodes, prefix, sniff, runner_id):
+def connectivity_pairs(nodes, runner_id):
+    """(source, target) host names for every path the case's nodes will use.
+
+    Instance i of a group talks to instance i % count of each group it
+    connects to or starts after, as handle_connection_strategy picks it.
+    Targets behind a NAT are not reachable from outside by design and
+    are left out."""
+    by_name = {node["name"]: node for node in nodes}
+    pairs = []
+    for node in nodes:
+        for dep in node_dependencies(node):
+            target = by_name.get(dep)
+            if target is None or target["type"] in ("nat", "multi_nat"):
+                continue
+            for i in range(int(node["count"])):
+                pair = (
+                    f'{node["name"]}_{i}_r{runner_id}',
+                    f'{dep}_{i % int(target["count"])}_r{runner_id}',
+                )
+                if pair not in pairs:
+                    pairs.append(pair)
+    return pairs
+
+
+def check_connectivity(net, pairs, timeout=REACHABILITY_TIMEOUT):
+    """Ping every pair concurrently; raise listing the pairs without a reply."""
+    if not pairs:
+        return
+
+    def reachable(pair):
+        src, dst = net.get(*pair)
+        # pexec spawns a process per ping, so one node can probe many targets at once
+        _, _, code = src.pexec(
+            f"ping -n -q -c 1 -i 0.2 -w {timeout} {dst.IP()}", shell=True
+        )
+        return code == 0
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(pairs)) as executor:
+        results = list(executor.map(reachable, pairs))
+    unreachable = [f"{src} -> {dst}" for (src, dst), ok in zip(pairs, results) if not ok]
+    if unreachable:
+        raise Exception(
+            f"No connectivity after {timeout}s on {len(unreachable)} of {len(pairs)} "
+            f"paths: {', '.join(unreachable)}"
+        )
+
+
+def host_interfaces(net, sniffer):
+    """(node name, node pid, interface) of every linked host interface."""
+    return [
+        (intf["node"], net.get(intf["node"]).pid, intf["interface"])
+        for intf in sniffer.get_topoinfo()["interfaces"]
+        if intf["type"] in HOST_TYPES
+    ]
+
+
+def prep_net(net, nodes, prefix, sniff, runner_id, fanout=1, capture=None):
     configure_multi_nat_hosts(net, nodes, runner_id)
-    sniffer = Sniffer(net=net, output="logs/" + prefix + ".pcap")
+    sniffer = Sniffer(
+        net=net, output="logs/" + prefix + ".pcap", fanout=fanout, capture=capture
+    )
     ti = sniffer.get_topoinfo()
     info("Testing network connectivity")
-    net.pingAll()
+    check_connectivity(net, connectivity_pairs(nodes, runner_id))
 
     info("Topology:", json.dumps(ti, indent=4))
     if sniff:
@@ -369,11 +554,264 @@ def prep_net(net, nodes, prefix, sniff, runner_id):
     return sniffer
 
 
-def run_case(nodes, runner_id, prefix, args, debug=False, visualize=False):
-    topo = StarTopo(nodes=nodes, runner_id=runner_id)
-    net = Mininet(topo=topo, waitConnected=True, link=TCLink)
+def node_dependencies(node):
+    """Names of the node groups that must be ready before this group starts."""
+    deps = [dep for dep in node.get("after", []) if dep != node["name"]]
+    connect = node.get("connect", {})
+    target = connect.get("node")
+    if connect.get("strategy", "none") != "none" and target and target != node["name"]:
+        deps.append(target)
+    return deps
+
+
+def validate_links(nodes):
+    """Raise if any node group has a link block or a set_link action tc
+    would reject."""
+    for node in nodes:
+        if "link" in node:
+            try:
+                validateLink(node["link"])
+            except (OSError, ValueError) as e:
+                raise ValueError(f"Node '{node['name']}': {e}")
+        for idx, action in enumerate(node.get("actions", [])):
+            if action.get("action") != "set_link":
+                continue
+            try:
+                validateLinkChange(action)
+            except ValueError as e:
+                raise ValueError(f"Node '{node['name']}' action {idx} (set_link): {e}")
+
+
+def case_capture(capture, args):
+    """A case's capture block, completed with the --capture-* options it
+    does not set itself."""
+    capture = dict(capture or {})
+    for key, value in (
+        ("snaplen", args.capture_snaplen),
+        ("format", args.capture_format),
+        ("rotate_mb", args.capture_rotate_mb),
+        ("rotate_s", args.capture_rotate_s),
+        ("files", args.capture_files),
+        ("ring_mb", args.capture_ring_mb),
+    ):
+        if value:
+            capture.setdefault(key, value)
+    return capture
+
+
+def validate_capture(capture, nodes):
+    """Raise if a capture block names protocols, ports, a snaplen, a
+    format, a ring size or windows the sniffer rejects."""
+    if capture:
+        captureFilter(
+            [1], capture.get("protocols"), capture.get("ports"), capture.get("snaplen", 0)
+        )
+        if capture.get("format", "pcap") not in FORMATS:
+            raise ValueError(f"Unknown capture format {capture['format']!r}")
+        ring_mb = capture.get("ring_mb", 1)
+        if not isinstance(ring_mb, int) or isinstance(ring_mb, bool) or ring_mb < 1:
+            raise ValueError(f"Capture ring_mb {ring_mb!r} must be a positive integer")
+        validateWindows(capture.get("windows", []), [node["name"] for node in nodes])
+
+
+def launch_dependencies(nodes):
+    """Names of the node groups each group waits for before it starts.
+
+    Besides its node_dependencies, a group waits for the group above it
+    in the file, as groups used to start one by one in file order,
+    unless that group already waits for it. A group that lists "after",
+    even an empty list, opts out and only waits for its
+    node_dependencies, so independent groups can start concurrently."""
+    deps = {node["name"]: node_dependencies(node) for node in nodes}
+
+    def waits_for(name, target, seen):
+        if name == target:
+            return True
+        seen.add(name)
+        return any(
+            waits_for(dep, target, seen)
+            for dep in deps.get(name, [])
+            if dep not in seen
+        )
+
+    for previous, node in zip(nodes, nodes[1:]):
+        name = node["name"]
+        if "after" in node or previous["name"] in deps[name]:
+            continue
+        if not waits_for(previous["name"], name, set()):
+            deps[name].append(previous["name"])
+    return deps
+
+
+def launch_order(nodes):
+    """Return node groups ordered so every group follows its dependencies."""
+    by_name = {node["name"]: node for node in nodes}
+    for node in nodes:
+        validate_probe(node)
+        for dep in node_dependencies(node):
+            if dep not in by_name:
+                raise ValueError(
+                    f"Launch dependency '{dep}' of node '{node['name']}' not found in simulation. "
+                    f"Available nodes: {', '.join(by_name.keys())}"
+                )
+
+    deps = launch_dependencies(nodes)
+    ordered, done, visiting = [], set(), []
+
+    def visit(name):
+        if name in done:
+            return
+        if name in visiting:
+            cycle = visiting[visiting.index(name):] + [name]
+            raise ValueError(f"Launch dependency cycle: {' -> '.join(cycle)}")
+        visiting.append(name)
+        for dep in deps[name]:
+            visit(dep)
+        visiting.pop()
+        done.add(name)
+        ordered.append(by_name[name])
+
+    for node in nodes:
+        visit(node["name"])
+    return ordered
+
+
+def launch_node_group(
+    net, node, runner_id, prefix, debug, node_counts, node_ips,
+    node_params, p_box, p_short_box, temp_dirs, cgroups=None,
+):
+    """Start every instance of a node group and block until the group is ready."""
+    instances = []
+    for i in range(int(node["count"])):
+        node_name = f'{node["name"]}_{i}_r{runner_id}'
+        n = net.get(node_name)
+
+        cmd = handle_connection_strategy(
+            node, node_counts, i, runner_id, node_ips, node_params
+        )
+
+        temp_dir = tempfile.TemporaryDirectory(
+            prefix="netsim", suffix=f"{prefix}_{node_name}_{runner_id}"
+        )
+        temp_dirs.append(temp_dir)
+
+        node_env = node.get("env", {})
+        env_vars = setup_env_vars(prefix, node_name, temp_dir.name, node_env, debug)
+
+        cgroup_procs = cgroups.node_procs(runner_id, node_name) if cgroups else None
+        p = execute_node_command(cmd, prefix, node_name, n, env_vars, cgroup_procs)
+        if "process" in node and node["process"] == "short":
+            p_short_box.append((node_name, p, cmd))
+        else:
+            p_box.append((node_name, p, cmd))
+        instances.append((node_name, n))
+
+    if "param_parser" in node:
+        node_params.update(parse_node_params(node, prefix, node_params, runner_id))
+    elif "ready" in node:
+        wait_ready(node, instances, prefix, node.get("wait", DEFAULT_READY_TIMEOUT))
+    elif "wait" in node:
+        time.sleep(int(node["wait"]))
+
+
+def shaping_checks(net, nodes, runner_id, interfaces=None):
+    """Collect the rate checks of each node group's shaped links.
+
+    interfaces: IntfSampler summary of the host interfaces. What a host
+    interface sent is checked against its own shaping (up), and what it
+    received against the shaping of the switch port facing it (down)."""
+    checks = {}
+    for node in nodes:
+        for i in range(int(node["count"])):
+            n = net.get(f'{node["name"]}_{i}_r{runner_id}')
+            for intf in n.intfList():
+                if not intf.link:
+                    continue
+                peer = intf.link.intf2 if intf.link.intf1 is intf else intf.link.intf1
+                for end, direction in ((intf, "tx"), (peer, "rx")):
+                    if not getattr(end, "rateCheck", None):
+                        continue
+                    counters = (interfaces or {}).get(intf.name)
+                    if counters:
+                        end.checkAchievedRate(
+                            counters[f"peak_{direction}_mbits"],
+                            counters[f"sustained_{direction}_mbits"],
+                            counters["sustained_window_s"],
+                        )
+                    checks.setdefault(node["name"], []).append(
+                        dict(
+                            end.rateCheck,
+                            interface=end.name,
+                            direction="up" if end is intf else "down",
+                        )
+                    )
+    return checks
+
+
+def build_network(
+    nodes, runner_id, multicast=False, backend="mininet", switch=DEFAULT_SWITCH
+):
+    topo = StarTopo(nodes=nodes, runner_id=runner_id, multicast=multicast)
+    # Queue the shaping of every interface while the links are built and
+    # apply it in one tc batch per namespace afterwards.
+    batch = TCBatch()
+    if backend == "netns" and not netnsSupported(nodes):
+        info("Case has NAT nodes, falling back to the mininet backend\n")
+        backend = "mininet"
+    if backend == "netns":
+        # The netns backend always bridges with plain Linux bridges
+        net = NetnsNet(topo, batch=batch)
+        switch = "bridge"
+    else:
+        switch_cls, controller = switchBackend(switch)
+        net = Mininet(
+            topo=topo,
+            switch=switch_cls,
+            controller=controller,
+            waitConnected=True,
+            link=partial(TCLink, batch=batch),
+        )
+    net.switch_backend = switch
+    batch.apply()
     net.start()
-    sniffer = prep_net(net, nodes, prefix, args.sniff | visualize, runner_id)
+    startMulticast(net)
+    return net
+
+
+def run_case(
+    nodes, runner_id, prefix, args, debug=False, visualize=False, pool=None,
+    multicast=False, switch=DEFAULT_SWITCH, cgroups=None, capture=None,
+):
+    validate_links(nodes)
+    capture = case_capture(capture, args)
+    timings = {}
+    start = time.monotonic()
+    if pool:
+        net = pool.acquire(nodes, runner_id, multicast, switch)
+    else:
+        net = build_network(nodes, runner_id, multicast, args.backend, switch)
+    timings["topology_build"] = time.monotonic() - start
+
+    start = time.monotonic()
+    try:
+        sniffer = prep_net(
+            net, nodes, prefix, args.sniff | visualize, runner_id,
+            args.capture_fanout, capture,
+        )
+    except Exception as e:
+        error(f"Network check failed for {prefix}: {e}\n")
+        FAILED_TESTS.append(
+            {"prefix": prefix, "errors": [{"node": "network", "reason": str(e)}]}
+        )
+        if pool:
+            pool.discard(runner_id)
+        else:
+            net.stop()
+        if args.integration:
+            raise
+        error(f"WARNING: Skipping {prefix} (not in integration mode)\n")
+        return (None, None, None)
+    timings["prep_net"] = time.monotonic() - start
 
     p_box, p_short_box = [], []
     temp_dirs = []
@@ -382,70 +820,136 @@ def run_case(nodes, runner_id, prefix, args, debug=False, visualize=False):
     node_ips = get_node_ips(net, nodes, runner_id)
     node_params = {}
 
-    for node in nodes:
-        for i in range(int(node["count"])):
-            node_name = f'{node["name"]}_{i}_r{runner_id}'
-            n = net.get(node_name)
+    launched = {}
 
-            cmd = handle_connection_strategy(
-                node, node_counts, i, runner_id, node_ips, node_params
+    # Stopped in the finally below, also when a launch fails, so no thread
+    # or cgroup of this case leaks into the next one on the runner slot
+    triggers = intf_sampler = proc_sampler = replayer = None
+    try:
+        if sniffer.writer and capture.get("windows"):
+            triggers = CaptureTriggers(
+                sniffer, capture["windows"], nodes, prefix, runner_id
             )
-
-            temp_dir = tempfile.TemporaryDirectory(
-                prefix="netsim", suffix=f"{prefix}_{node_name}_{runner_id}"
+            triggers.begin()
+
+        deps = launch_dependencies(nodes)
+
+        def launch(node):
+            for dep in deps[node["name"]]:
+                launched[dep].result()
+            if triggers:
+                triggers.started(node["name"])
+            launch_node_group(
+                net, node, runner_id, prefix, debug, node_counts, node_ips,
+                node_params, p_box, p_short_box, temp_dirs, cgroups,
             )
-            temp_dirs.append(temp_dir)
-
-            node_env = node.get("env", {})
-            env_vars = setup_env_vars(prefix, node_name, temp_dir.name, node_env, debug)
-
-            p = execute_node_command(cmd, prefix, node_name, n, env_vars)
-            if "process" in node and node["process"] == "short":
-                p_short_box.append((node_name, p, cmd))
-            else:
-                p_box.append((node_name, p, cmd))
 
-        if "param_parser" in node:
-            node_params.update(parse_node_params(node, prefix, node_params, runner_id))
-        elif "wait" in node:
-            time.sleep(int(node["wait"]))
-
-    # CLI(net)
+        if args.intf_interval > 0:
+            intf_sampler = IntfSampler(
+                args.intf_interval / 1000, host_interfaces(net, sniffer)
+            )
+            intf_sampler.begin()
 
-    scheduled_actions = schedule_actions(net, nodes, runner_id)
-    process_errors = monitor_short_processes(
-        p_short_box, prefix, net, scheduled_actions, runner_id
-    )
-    if process_errors:
-        error("\n" + "=" * 80 + "\n")
-        error(f"PROCESS ERRORS DETECTED in {prefix}:\n")
-        error("=" * 80 + "\n")
-        for err_msg in process_errors:
-            error(err_msg + "\n")
-        error("=" * 80 + "\n")
-        failure_entry = {"prefix": prefix, "errors": []}
-        for err_msg in process_errors:
-            if err_msg.startswith("TIMEOUT:"):
-                node = err_msg.split("'")[1]
-                reason = f"timeout after {TIMEOUT}s"
-            elif err_msg.startswith("FAILED:"):
-                node = err_msg.split("'")[1]
-                code_start = err_msg.find("code ") + 5
-                code_end = err_msg.find(".", code_start)
-                reason = f"exit code {err_msg[code_start:code_end]}"
+        if args.proc_interval > 0:
+            proc_sampler = ProcSampler(
+                args.proc_interval / 1000, [p_box, p_short_box], cgroups, runner_id
+            )
+            proc_sampler.begin()
+
+        # Groups start as soon as the groups they wait for are ready, so
+        # groups that opt out of file order can come up concurrently.
+        start = time.monotonic()
+        ordered = launch_order(nodes)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(ordered)) as executor:
+            for node in ordered:
+                launched[node["name"]] = executor.submit(launch, node)
+        for future in launched.values():
+            future.result()
+        timings["node_launch"] = time.monotonic() - start
+
+        # CLI(net)
+
+        trace_targets = traceTargets(net, nodes, runner_id)
+        if trace_targets:
+            replayer = TraceReplayer(trace_targets)
+            replayer.begin()
+
+        scheduled_actions = schedule_actions(net, nodes, runner_id)
+        process_errors, fired_actions = monitor_short_processes(
+            p_short_box, prefix, net, scheduled_actions, runner_id,
+            triggers.action if triggers else None,
+        )
+        if triggers:
+            triggers.stop()
+        if fired_actions:
+            with open(f"logs/{prefix}.actions.json", "w+") as f:
+                f.write(json.dumps(fired_actions, indent=4))
+        if proc_sampler:
+            proc_sampler.stop()
+            proc_sampler.write(f"logs/{prefix}.proc.jsonl")
+        if intf_sampler:
+            intf_sampler.stop()
+            intf_sampler.write(f"logs/{prefix}.intf.jsonl")
+        if replayer:
+            replayer.stop()
+            with open(f"logs/{prefix}.link_trace.json", "w+") as f:
+                f.write(json.dumps(replayer.schedule, indent=4))
+        if process_errors:
+            error("\n" + "=" * 80 + "\n")
+            error(f"PROCESS ERRORS DETECTED in {prefix}:\n")
+            error("=" * 80 + "\n")
+            for err_msg in process_errors:
+                error(err_msg + "\n")
+            error("=" * 80 + "\n")
+            failure_entry = {"prefix": prefix, "errors": []}
+            for err_msg in process_errors:
+                if err_msg.startswith("TIMEOUT:"):
+                    node = err_msg.split("'")[1]
+                    reason = f"timeout after {TIMEOUT}s"
+                elif err_msg.startswith("FAILED:"):
+                    node = err_msg.split("'")[1]
+                    code_start = err_msg.find("code ") + 5
+                    code_end = err_msg.find(".", code_start)
+                    reason = f"exit code {err_msg[code_start:code_end]}"
+                else:
+                    node = "unknown"
+                    reason = err_msg[:50]
+                failure_entry["errors"].append({"node": node, "reason": reason})
+            FAILED_TESTS.append(failure_entry)
+            if args.integration:
+                eject(nodes, prefix, runner_id, temp_dirs)
             else:
-                node = "unknown"
-                reason = err_msg[:50]
-            failure_entry["errors"].append({"node": node, "reason": reason})
-        FAILED_TESTS.append(failure_entry)
-        if args.integration:
-            eject(nodes, prefix, runner_id, temp_dirs)
-        else:
-            error("WARNING: Continuing despite errors (not in integration mode)\n")
-
-    terminate_processes(p_box, prefix)
-    cleanup_tmp_dirs(temp_dirs)
-    return (net, sniffer)
+                error("WARNING: Continuing despite errors (not in integration mode)\n")
+
+        terminate_processes(p_box, prefix)
+        cleanup_tmp_dirs(temp_dirs)
+        case_info = {
+            "timings": timings,
+            "shaping": shaping_checks(
+                net, nodes, runner_id, intf_sampler.summary if intf_sampler else None
+            ),
+            "actions": fired_actions,
+            "switch": net.switch_backend,
+        }
+        if cgroups:
+            case_info["cgroup"] = cgroups.allocation(runner_id)
+            case_info["resources"] = {
+                node_name: cgroups.node_usage(runner_id, node_name)
+                for node_name, _, _ in p_box + p_short_box
+            }
+        if proc_sampler:
+            case_info["proc"] = proc_sampler.summary
+        if intf_sampler:
+            case_info["interfaces"] = intf_sampler.summary
+        if replayer:
+            case_info["link_trace"] = replayer.summary()
+        return (net, sniffer, case_info)
+    finally:
+        for running in (triggers, proc_sampler, intf_sampler, replayer):
+            if running:
+                running.stop()
+        if cgroups:
+            cgroups.release(runner_id)
 
 
 def validate_integration_results(nodes, prefix, runner_id, args):
@@ -478,22 +982,45 @@ def validate_integration_results(nodes, prefix, runner_id, args):
             raise
 
 
-def run(case, runner_id, name, args):
+def run(case, runner_id, name, args, pool=None, cgroups=None):
     prefix = name + "__" + case["name"]
     nodes = case["nodes"]
     viz = False
     if "visualize" in case:
         viz = case["visualize"] & args.visualize
     print('Running "%s"...' % prefix)
-    n, s = (None, None)
+    n, s, case_info = (None, None, None)
     if not args.reports_only:
-        (n, s) = run_case(nodes, runner_id, prefix, args, args.debug, viz)
-    process_logs(nodes, prefix, runner_id)
+        (n, s, case_info) = run_case(
+            nodes, runner_id, prefix, args, args.debug, viz, pool,
+            case.get("multicast", False), case.get("switch", DEFAULT_SWITCH),
+            cgroups, case.get("capture"),
+        )
+        if case_info is None:
+            # The network failed its checks and the case was skipped
+            return (None, None)
+    reports = process_logs(nodes, prefix, runner_id, case_info)
+    if case.get("calibration") and case_info and reports:
+        # Under --backend netns every case runs on the bridge, which would
+        # record its throughput as the ceiling of the case's switch
+        switch = case.get("switch", DEFAULT_SWITCH)
+        if case_info["switch"] == switch:
+            record_ceiling(switch, reports)
+        else:
+            error(
+                f"Not recording {prefix} as the {switch} ceiling, "
+                f"it ran on {case_info['switch']}\n"
+            )
     process_integration_logs(nodes, prefix, runner_id)
     validate_integration_results(nodes, prefix, runner_id, args)
     if viz:
+        viz_path = "logs/" + prefix + ".viz.pcap"
+        if s and s.writer:
+            # Everything captured has to be on disk before it is drawn
+            s.close()
+            viz_path = s.writer.viz.paths[0]
         viz_args = {
-            "path": "logs/" + prefix + ".viz.pcap",
+            "path": viz_path,
             "keylog": "logs/keylog_" + prefix + "_iroh_srv_0.txt",
             "topo": "logs/" + prefix + ".topo.json",
             "output": "viz/" + prefix + ".svg",
@@ -502,39 +1029,81 @@ def run(case, runner_id, name, args):
     return (n, s)
 
 
-def run_parallel(cases, name, skiplist, onlylist, args, max_workers=4):
-    filtered = []
-    for case in cases:
-        prefix = name + "__" + case["name"]
-        if onlylist and not any(f in prefix for f in onlylist):
-            print("Skipping:", prefix)
-        elif any(f in prefix for f in skiplist):
-            print("Skipping:", prefix)
-        else:
-            filtered.append(case)
+def run_parallel(sims, skiplist, onlylist, args, max_workers=4):
+    """Run the cases of all given sims, packed onto max_workers runner slots.
+
+    sims: list of (sim name, cases)"""
+    history = load_history()
+    jobs = []
+    for name, cases in sims:
+        for case in cases:
+            prefix = name + "__" + case["name"]
+            if onlylist and not any(f in prefix for f in onlylist):
+                print("Skipping:", prefix)
+            elif any(f in prefix for f in skiplist):
+                print("Skipping:", prefix)
+            else:
+                jobs.append(
+                    {
+                        "name": name,
+                        "case": case,
+                        "cpu": case_cpu(case, args.cpu_budget),
+                        "duration": case_duration(case, history, prefix),
+                    }
+                )
 
-    if not filtered:
+    if not jobs:
         return
 
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        chunks = [filtered[i : i + max_workers] for i in range(0, len(filtered), max_workers)]
-        for chunk in chunks:
-            futures = []
-            r = []
-            for i, case in enumerate(chunk):
-                futures.append(executor.submit(run, case, i, name, args))
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    rx = future.result()
-                    r.append(rx)
-                except Exception as e:
-                    print("Exception:", e)
-                    sys.exit(1)
-            for n, s in r:
-                if n:
-                    n.stop()
-                if s:
-                    s.close()
+    # Reject bad switches and link impairments before any network of the
+    # sims is started
+    for job in jobs:
+        switchBackend(job["case"].get("switch", DEFAULT_SWITCH))
+        validate_links(job["case"]["nodes"])
+        validate_capture(
+            case_capture(job["case"].get("capture"), args), job["case"]["nodes"]
+        )
+
+    pool = (
+        TopologyPool(
+            [job["case"] for job in jobs], partial(build_network, backend=args.backend)
+        )
+        if args.reuse_topology
+        else None
+    )
+
+    def run_in_slot(job, runner_id):
+        start = time.monotonic()
+        n, s = run(job["case"], runner_id, job["name"], args, pool, cgroups)
+        if n and not (pool and pool.owns(n)):
+            n.stop()
+        if s:
+            s.close()
+        record_duration(
+            history, job["name"] + "__" + job["case"]["name"], time.monotonic() - start
+        )
+
+    # Runner ids are handed out as slots free up, so a finished case
+    # immediately makes room for the next pending one, from any sim.
+    scheduler = CaseScheduler(min(max_workers, len(jobs)), args.cpu_budget)
+    cgroups = None
+    try:
+        cgroups = RunnerCgroups(scheduler.slots, args.cpuset, args.runner_memory)
+    except (OSError, RuntimeError) as e:
+        if args.cpuset or args.runner_memory:
+            raise
+        error(f"Per-node resource accounting disabled: {e}\n")
+    try:
+        scheduler.run(jobs, run_in_slot)
+    except Exception as e:
+        print("Exception:", e)
+        sys.exit(1)
+    finally:
+        save_history(history)
+        if pool:
+            pool.close()
+        if cgroups:
+            cgroups.close()
 
 
 if __name__ == "__main__":
@@ -558,6 +1127,48 @@ if __name__ == "__main__":
         action="store_true",
         default=False,
     )
+    parser.add_argument(
+        "--capture-fanout",
+        help="Packet ring sockets and threads the sniffer spreads traffic over",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--capture-ring-mb",
+        help="MiB of memory of each packet ring socket (default: 32)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--capture-snaplen",
+        help="Bytes of each frame the sniffer keeps, e.g. 128 for headers only (0: all)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--capture-format",
+        help="Capture file format (default: pcap)",
+        choices=list(FORMATS),
+        default=None,
+    )
+    parser.add_argument(
+        "--capture-rotate-mb",
+        help="Start a new capture file after this many MB (0: never)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--capture-rotate-s",
+        help="Start a new capture file after this many seconds (0: never)",
+        type=float,
+        default=0,
+    )
+    parser.add_argument(
+        "--capture-files",
+        help="Keep only the newest N rotated capture files (0: all)",
+        type=int,
+        default=0,
+    )
     parser.add_argument("--skip", help="Comma separated list of tests to skip")
     parser.add_argument("--only", help="Comma separated list of tests to run exclusively")
     parser.add_argument(
@@ -569,6 +1180,47 @@ if __name__ == "__main__":
     parser.add_argument(
         "--max-workers", help="Max workers for parallel execution", type=int, default=1
     )
+    parser.add_argument(
+        "--cpu-budget",
+        help="Cores parallel cases may keep busy together (default: all)",
+        type=float,
+        default=os.cpu_count(),
+    )
+    parser.add_argument(
+        "--cpuset",
+        help="Give every runner slot its own cores through a cgroup v2 cpuset",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--runner-memory",
+        help="memory.max of each runner slot's cgroup, e.g. 4G",
+        default=None,
+    )
+    parser.add_argument(
+        "--proc-interval",
+        help="Sample CPU, RSS and threads of node processes every N ms (0: off)",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--intf-interval",
+        help="Sample host interface counters every N ms (0: off)",
+        type=int,
+        default=100,
+    )
+    parser.add_argument(
+        "--reuse-topology",
+        help="Keep networks alive between cases with the same topology shape",
+        action="store_true",
+        default=False,
+    )
+    parser.add_argument(
+        "--backend",
+        help="Network backend: full mininet, or plain namespaces and a Linux bridge",
+        choices=["mininet", "netns"],
+        default="mininet",
+    )
     parser.add_argument(
         "--netsim-log-level", help="Set log level for netsim", default="error"
     )
@@ -589,13 +1241,25 @@ if __name__ == "__main__":
 
     print("Args:", args)
 
+    calibration, sims = [], []
     for path in paths:
         config_f = open(path, "r")
         config = json.load(config_f)
         config_f.close()
-        name = config["name"]
+        # Sim wide settings apply to every case that does not override them
+        for case in config["cases"]:
+            for key in ("switch", "calibration", "capture"):
+                if key in config:
+                    case.setdefault(key, config[key])
         print(f"Start testing: %s\n" % path)
-        run_parallel(config["cases"], name, skiplist, onlylist, args, args.max_workers)
+        group = calibration if config.get("calibration", False) else sims
+        group.append((config["name"], config["cases"]))
+
+    # Calibration sims measure the emulator ceiling the others are compared
+    # to, so they run first and on their own
+    for group in (calibration, sims):
+        if group:
+            run_parallel(group, skiplist, onlylist, args, args.max_workers)
 
     write_failure_summary()
     print("Done")
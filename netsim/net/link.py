@@ -29,7 +29,11 @@ TCIntf: interface with bandwidth limiting and delay via tc
 Link: basic link class for creating veth pairs
 """
 
+import gzip
+import os
 import re
+import tempfile
+import threading
 
 from mininet.log import info, error, debug
 from mininet.util import makeIntfPair
@@ -37,6 +41,36 @@ from mininet.util import makeIntfPair
 # Make pylint happy:
 # pylint: disable=too-many-arguments
 
+# Above this rate (Mbit/s) the fixed 15k bursts cannot sustain the
+# configured rate, so shaping parameters are derived from rate and HZ.
+HIGH_RATE_THRESHOLD = 1000
+
+# Leaf qdiscs that may be attached below the shaper
+LEAF_QDISCS = ("fq", "fq_codel")
+
+_kernelHZ = None
+
+
+def kernelHZ(default=250):
+    "Return the kernel timer frequency (CONFIG_HZ) used to size token buckets"
+    global _kernelHZ  # pylint: disable=global-statement
+    if _kernelHZ is not None:
+        return _kernelHZ
+    _kernelHZ = default
+    try:
+        with open("/boot/config-%s" % os.uname().release) as f:
+            config = f.read()
+    except OSError:
+        try:
+            with gzip.open("/proc/config.gz", "rt") as f:
+                config = f.read()
+        except OSError:
+            return _kernelHZ
+    match = re.search(r"^CONFIG_HZ=(\d+)$", config, re.MULTILINE)
+    if match:
+        _kernelHZ = int(match.group(1))
+    return _kernelHZ
+
 
 class Intf(object):
 
@@ -236,10 +270,38 @@ class TCIntf(Intf):
     Allows specification of bandwidth limits (various methods)
     as well as delay, loss and max queue length"""
 
-    # The parameters we use seem to work reasonably up to 1 Gb/sec
-    # For higher data rates, we will probably need to change them.
+    # The fixed parameters work reasonably up to 1 Gb/sec. Above that
+    # (or with high_rate=True) burst, cburst and quantum are derived from
+    # the rate and the kernel HZ instead, see highRateParams().
     bwParamMax = 100000000
 
+    # htb warns about (and misbehaves with) quanta above this size
+    htbQuantumMax = 200000
+
+    # Programmed and achieved shaping rate, see checkProgrammedRate()
+    # and checkAchievedRate()
+    rateCheck = None
+
+    # Parameters of the current qdisc tree and where netem hangs in it
+    shaping = None
+    netemParent = None
+
+    def __init__(self, *args, **kwargs):
+        # Held while shaping is read, pushed to tc and recorded: the trace
+        # replayer, set_link actions and pool resets run on different threads
+        self.shapingLock = threading.RLock()
+        Intf.__init__(self, *args, **kwargs)
+
+    @staticmethod
+    def highRateParams(bw):
+        """Return (burst, quantum) in bytes for a token bucket at bw Mbit/s.
+        The bucket has to hold at least one timer tick worth of data,
+        otherwise the shaper cannot refill fast enough to reach bw."""
+        perTick = int(bw * 1e6 / 8 / kernelHZ())
+        burst = max(15000, perTick)
+        quantum = max(1514, min(perTick, TCIntf.htbQuantumMax))
+        return burst, quantum
+
     def bwCmds(
         self,
         bw=None,
@@ -249,6 +311,7 @@ class TCIntf(Intf):
         latency_ms=None,
         enable_ecn=False,
         enable_red=False,
+        high_rate=False,
     ):
         "Return tc commands to set bandwidth"
 
@@ -265,6 +328,7 @@ class TCIntf(Intf):
             # BL: this seems a bit brittle...
             if speedup > 0 and self.node.name[0:1] == "s":
                 bw = speedup
+            high_rate = high_rate or bw > HIGH_RATE_THRESHOLD
             # This may not be correct - we should look more closely
             # at the semantics of burst (and cburst) to make sure we
             # are specifying the correct sizes. For now I have used
@@ -275,6 +339,14 @@ class TCIntf(Intf):
                     "%s class add dev %s parent 5:0 classid 5:1 hfsc sc "
                     + "rate %fMbit ul rate %fMbit" % (bw, bw),
                 ]
+            elif use_tbf and high_rate:
+                burst, _ = self.highRateParams(bw)
+                if latency_ms is None:
+                    latency_ms = max(1.0, burst * 8.0 / (bw * 1000))
+                cmds += [
+                    "%s qdisc add dev %s root handle 5: tbf "
+                    + "rate %fMbit burst %d latency %fms" % (bw, burst, latency_ms)
+                ]
             elif use_tbf:
                 if latency_ms is None:
                     latency_ms = 15.0 * 8 / bw
@@ -282,6 +354,14 @@ class TCIntf(Intf):
                     "%s qdisc add dev %s root handle 5: tbf "
                     + "rate %fMbit burst 15000 latency %fms" % (bw, latency_ms)
                 ]
+            elif high_rate:
+                burst, quantum = self.highRateParams(bw)
+                cmds += [
+                    "%s qdisc add dev %s root handle 5:0 htb default 1",
+                    "%s class add dev %s parent 5:0 classid 5:1 htb "
+                    + "rate %fMbit burst %d cburst %d quantum %d"
+                    % (bw, burst, burst, quantum),
+                ]
             else:
                 cmds += [
                     "%s qdisc add dev %s root handle 5:0 htb default 1",
@@ -313,27 +393,296 @@ class TCIntf(Intf):
                 parent = " parent 6: "
         return cmds, parent
 
+    # netem parameters beyond delay/jitter/loss/limit
+    netemExtraParams = (
+        "loss_model",
+        "reorder",
+        "duplicate",
+        "corrupt",
+        "rate",
+        "distribution",
+    )
+    # Distribution tables iproute2 installs in /usr/lib/tc
+    netemDistributions = ("normal", "pareto", "paretonormal")
+    netemLossModels = {
+        "gemodel": ("p", "r", "1-h", "1-k"),
+        "state": ("p13", "p31", "p32", "p23", "p14"),
+    }
+
+    # tc TIME and RATE values given as strings, e.g. "10ms" or "10mbit"
+    netemTime = re.compile(r"^\d+(\.\d+)?(s|sec|secs|ms|msec|msecs|us|usec|usecs)?$")
+    netemRate = re.compile(r"^\d+(\.\d+)?([kmgt]i?)?(bit|bps)$", re.IGNORECASE)
+
     @staticmethod
-    def delayCmds(parent, delay=None, jitter=None, loss=None, max_queue_size=None):
-        "Internal method: return tc commands for delay and loss"
+    def _number(value):
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    @classmethod
+    def _percent(cls, name, value):
+        "Format a netem percentage, rejecting values outside 0..100"
+        if not cls._number(value) or value < 0 or value > 100:
+            raise ValueError("Bad %s percentage %r" % (name, value))
+        return "%.5f%%" % value
+
+    @classmethod
+    def _time(cls, name, value):
+        "Format a netem time: a number as tc reads it, or a string like '10ms'"
+        if cls._number(value) and value >= 0:
+            return "%s" % value
+        if isinstance(value, str) and cls.netemTime.match(value):
+            return value
+        raise ValueError(
+            "Bad %s %r, expected a number or a time like '10ms'" % (name, value)
+        )
+
+    @classmethod
+    def _rate(cls, value):
+        "Format a netem rate: Mbit/s as a number, or a string like '10mbit'"
+        if cls._number(value) and value > 0:
+            return "%fMbit" % value
+        if isinstance(value, str) and cls.netemRate.match(value):
+            return value
+        raise ValueError(
+            "Bad netem rate %r, expected Mbit/s or a rate like '10mbit'" % (value,)
+        )
+
+    @classmethod
+    def _lossModel(cls, loss_model):
+        """Return (model, parameters) of {"gemodel": {"p": .., ...}}, or of
+        the flat {"model": "gemodel", "p": .., ...}"""
+        if not isinstance(loss_model, dict):
+            raise ValueError("Bad loss model %r" % (loss_model,))
+        if "model" in loss_model:
+            return loss_model["model"], {
+                k: v for k, v in loss_model.items() if k != "model"
+            }
+        if len(loss_model) != 1:
+            raise ValueError(
+                "Loss model needs exactly one of %s" % ", ".join(cls.netemLossModels)
+            )
+        (model, params), = loss_model.items()
+        if not isinstance(params, dict):
+            raise ValueError("Bad %s parameters %r" % (model, params))
+        return model, params
+
+    @classmethod
+    def _percentCorr(cls, name, value):
+        "Format PERCENT [CORRELATION] from a number or a dict"
+        if not isinstance(value, dict):
+            return cls._percent(name, value)
+        unknown = set(value) - {"percent", "correlation"}
+        if unknown or "percent" not in value:
+            raise ValueError("Bad %s parameters %r" % (name, value))
+        args = cls._percent(name, value["percent"])
+        if "correlation" in value:
+            args += " " + cls._percent(name + " correlation", value["correlation"])
+        return args
+
+    @classmethod
+    def netemArgs(
+        cls,
+        delay=None,
+        jitter=None,
+        loss=None,
+        max_queue_size=None,
+        loss_model=None,
+        reorder=None,
+        duplicate=None,
+        corrupt=None,
+        rate=None,
+        distribution=None,
+    ):
+        """Return the netem argument string for the given impairments.
+        delay, jitter: number as tc reads it or a time string like "10ms"
+        loss: percent
+        loss_model: {"gemodel": {"p": .., "r": .., "1-h": .., "1-k": ..}}
+                    or {"state": {"p13": .., "p31": .., ...}}
+        reorder: percent or {"percent", "correlation", "gap"}
+        duplicate, corrupt: percent or {"percent", "correlation"}
+        rate: Mbit/s, a rate string like "10mbit", or
+              {"bw", "packet_overhead", "cell_size", "cell_overhead"}
+        distribution: delay distribution for jitter (normal, pareto,
+                      paretonormal)
+        Raises ValueError for invalid or inconsistent parameters."""
+        args = []
+        if delay is not None:
+            args.append("delay %s " % cls._time("delay", delay))
+        if jitter is not None:
+            if delay is None:
+                raise ValueError("jitter requires delay")
+            args.append("%s " % cls._time("jitter", jitter))
+        if distribution is not None:
+            if jitter is None:
+                raise ValueError("distribution requires jitter")
+            if distribution not in cls.netemDistributions:
+                raise ValueError("Unknown delay distribution %r" % distribution)
+            args.append("distribution %s " % distribution)
+        if loss is not None:
+            cls._percent("loss", loss)
+        if loss:
+            if loss_model is not None:
+                raise ValueError("loss and loss_model are mutually exclusive")
+            args.append("loss %.5f " % loss)
+        if loss_model is not None:
+            model, loss_model = cls._lossModel(loss_model)
+            if model not in cls.netemLossModels:
+                raise ValueError("Unknown loss model %r" % model)
+            keys = cls.netemLossModels[model]
+            unknown = set(loss_model) - set(keys)
+            if unknown:
+                raise ValueError("Unknown %s parameters %s" % (model, sorted(unknown)))
+            given = [k for k in keys if k in loss_model]
+            # netem takes the probabilities positionally, so only a prefix
+            # of them may be given
+            if not given or given != list(keys[: len(given)]):
+                raise ValueError(
+                    "%s needs parameters in order %s" % (model, ", ".join(keys))
+                )
+            probs = " ".join(cls._percent(model, loss_model[k]) for k in given)
+            args.append("loss %s %s " % (model, probs))
+        if duplicate is not None:
+            args.append("duplicate %s " % cls._percentCorr("duplicate", duplicate))
+        if corrupt is not None:
+            args.append("corrupt %s " % cls._percentCorr("corrupt", corrupt))
+        if reorder is not None:
+            if delay is None:
+                raise ValueError("reorder requires delay")
+            gap = None
+            if isinstance(reorder, dict):
+                gap = reorder.get("gap")
+                reorder = {k: v for k, v in reorder.items() if k != "gap"}
+            args.append("reorder %s " % cls._percentCorr("reorder", reorder))
+            if gap is not None:
+                if not isinstance(gap, int) or isinstance(gap, bool) or gap < 1:
+                    raise ValueError("Bad reorder gap %r" % (gap,))
+                args.append("gap %d " % gap)
+        if rate is not None:
+            spec = rate if isinstance(rate, dict) else {"bw": rate}
+            unknown = set(spec) - {"bw", "packet_overhead", "cell_size", "cell_overhead"}
+            if unknown or "bw" not in spec:
+                raise ValueError("Bad netem rate %r" % (rate,))
+            rateArgs = [cls._rate(spec["bw"])]
+            for key in ("packet_overhead", "cell_size", "cell_overhead"):
+                if key not in spec:
+                    break
+                if not isinstance(spec[key], int) or isinstance(spec[key], bool):
+                    raise ValueError("Bad netem rate %s %r" % (key, spec[key]))
+                rateArgs.append("%d" % spec[key])
+            args.append("rate %s " % " ".join(rateArgs))
+        if max_queue_size is not None:
+            if not isinstance(max_queue_size, int) or max_queue_size < 0:
+                raise ValueError("Bad queue size %r" % (max_queue_size,))
+            args.append("limit %d" % max_queue_size)
+        return "".join(args)
+
+    @classmethod
+    def delayCmds(cls, parent, delay=None, jitter=None, loss=None, max_queue_size=None,
+                  **extra):
+        """Internal method: return tc commands for delay, loss and the
+        other netem impairments in netemExtraParams"""
         cmds = []
-        if loss and (loss < 0 or loss > 100):
-            error("Bad loss percentage", loss, "%%\n")
-        else:
-            # Delay/jitter/loss/max queue size
-            netemargs = "%s%s%s%s" % (
-                "delay %s " % delay if delay is not None else "",
-                "%s " % jitter if jitter is not None else "",
-                "loss %.5f " % loss if (loss is not None and loss > 0) else "",
-                "limit %d" % max_queue_size if max_queue_size is not None else "",
+        try:
+            # Delay/jitter/loss/max queue size and other impairments
+            netemargs = cls.netemArgs(
+                delay=delay,
+                jitter=jitter,
+                loss=loss,
+                max_queue_size=max_queue_size,
+                **extra
             )
-            if netemargs:
-                cmds = [
-                    "%s qdisc add dev %s " + parent + " handle 10: netem " + netemargs
-                ]
-                parent = " parent 10:1 "
+        except ValueError as e:
+            error("Bad netem parameters:", e, "- ignoring\n")
+            return cmds, parent
+        if netemargs:
+            cmds = [
+                "%s qdisc add dev %s " + parent + " handle 10: netem " + netemargs
+            ]
+            parent = " parent 10:1 "
         return cmds, parent
 
+    _rateRegex = re.compile(r"\brate (\d+(?:\.\d+)?)([KMGT]?)bit")
+    _rateUnits = {"": 1e-6, "K": 1e-3, "M": 1.0, "G": 1e3, "T": 1e6}
+
+    _overlimitsRegex = re.compile(r"\boverlimits (\d+)")
+    _burstRegex = re.compile(r"\bburst (\d+(?:\.\d+)?)([KMG]?)b\b")
+    _sizeUnits = {"": 1, "K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+
+    def shaperStats(self, stats=False):
+        "tc output of our shaper: the htb class 5:1 or the tbf qdisc 5:"
+        flag = "-s" if stats else "-d"
+        output = self.tc("%s " + flag + " class show dev %s classid 5:1")
+        if "htb" not in output:
+            output = self.tc("%s " + flag + " qdisc show dev %s handle 5:")
+        return output
+
+    def programmedRate(self):
+        "Return the rate (Mbit/s) the kernel programmed for our shaper, or None"
+        match = self._rateRegex.search(self.shaperStats())
+        if not match:
+            return None
+        return float(match.group(1)) * self._rateUnits[match.group(2)]
+
+    def checkProgrammedRate(self, bw, tolerance=0.01):
+        """Compare the rate tc programmed into the kernel with the
+        configured one, which catches rounding of the shaper's rate.
+        The result is kept in self.rateCheck for reporting."""
+        programmed = self.programmedRate()
+        self.rateCheck = {
+            "configured_mbits": bw,
+            "programmed_mbits": programmed,
+            "hz": kernelHZ(),
+            "programmed_ok": programmed is not None
+            and abs(programmed - bw) <= bw * tolerance,
+        }
+        self.rateCheck["ok"] = self.rateCheck["programmed_ok"]
+        if not self.rateCheck["programmed_ok"]:
+            error(
+                "*** Warning: %s programmed at %s Mbit/s, configured %s Mbit/s\n"
+                % (self, programmed, bw)
+            )
+        return self.rateCheck
+
+    def shaperBurst(self):
+        "Return the burst (bytes) of our shaper, or 0"
+        match = self._burstRegex.search(self.shaperStats())
+        if not match:
+            return 0
+        return int(float(match.group(1)) * self._sizeUnits[match.group(2)])
+
+    def checkAchievedRate(self, peak, sustained, window, tolerance=0.05):
+        """Compare the rate the link achieved with the configured one.
+
+        peak: the highest Mbit/s between two samples of the interface
+        byte counters; sustained: the highest Mbit/s over `window`
+        seconds. The sustained rate must not exceed the configured rate
+        by more than the shaper's burst spread over the window. If the
+        shaper held packets back (overlimits), the offered load was above
+        the rate, so the peak must reach it."""
+        if not self.rateCheck:
+            return None
+        bw = self.rateCheck["configured_mbits"]
+        burst = self.shaperBurst()
+        limit = bw * (1 + tolerance) + burst * 8 / window / 1e6
+        match = self._overlimitsRegex.search(self.shaperStats(stats=True))
+        backlogged = bool(match and int(match.group(1)))
+        ok = sustained <= limit
+        if backlogged:
+            ok = ok and peak >= bw * (1 - tolerance)
+        self.rateCheck.update(
+            peak_mbits=peak,
+            sustained_mbits=sustained,
+            burst_bytes=burst,
+            backlogged=backlogged,
+            achieved_ok=ok,
+            ok=self.rateCheck["programmed_ok"] and ok,
+        )
+        if not ok:
+            error(
+                "*** Warning: %s achieved %s Mbit/s sustained, %s Mbit/s peak, "
+                "configured %s Mbit/s\n" % (self, sustained, peak, bw)
+            )
+        return self.rateCheck
+
     def tc(self, cmd, tc="tc"):
         "Execute tc command for our interface"
         c = cmd % (tc, self)  # Add in tc command and our name
@@ -357,6 +706,15 @@ class TCIntf(Intf):
         enable_ecn=False,
         enable_red=False,
         max_queue_size=None,
+        high_rate=False,
+        leaf=None,
+        loss_model=None,
+        reorder=None,
+        duplicate=None,
+        corrupt=None,
+        rate=None,
+        distribution=None,
+        batch=None,
         **params
     ):
         """Configure the port and set its properties.
@@ -373,7 +731,14 @@ class TCIntf(Intf):
         latency_ms: TBF latency parameter
         enable_ecn: enable ECN (False)
         enable_red: enable RED (False)
-        max_queue_size: queue limit parameter for netem"""
+        max_queue_size: queue limit parameter for netem
+        high_rate: derive burst/cburst/quantum from rate and HZ
+                   (always on above HIGH_RATE_THRESHOLD)
+        leaf: optional leaf qdisc below the shaper (fq or fq_codel)
+        loss_model, reorder, duplicate, corrupt, rate, distribution:
+               further netem impairments, see netemArgs()
+        batch: optional TCBatch to queue commands on instead of
+               running them one by one"""
 
         # Support old names for parameters
         gro = not params.pop("disable_gro", not gro)
@@ -385,19 +750,58 @@ class TCIntf(Intf):
             return "on" if isOn else "off"
 
         # Set offload parameters with ethool
-        self.cmd("ethtool -K", self, "gro", on(gro), "tx", on(txo), "rx", on(rxo))
+        ethtool = "ethtool -K %s gro %s tx %s rx %s" % (self, on(gro), on(txo), on(rxo))
+        if batch is not None:
+            batch.addCmd(self, ethtool)
+        else:
+            self.cmd(ethtool)
+
+        # Remember the shaping so it can later be changed in place
+        self.shaping = {
+            "bw": bw,
+            "delay": delay,
+            "jitter": jitter,
+            "loss": loss,
+            "max_queue_size": max_queue_size,
+            "speedup": speedup,
+            "use_hfsc": use_hfsc,
+            "use_tbf": use_tbf,
+            "latency_ms": latency_ms,
+            "enable_ecn": enable_ecn,
+            "enable_red": enable_red,
+            "high_rate": high_rate,
+            "leaf": leaf,
+        }
+        netemExtra = {
+            "loss_model": loss_model,
+            "reorder": reorder,
+            "duplicate": duplicate,
+            "corrupt": corrupt,
+            "rate": rate,
+            "distribution": distribution,
+        }
+        self.shaping.update(netemExtra)
+        netemExtra = {k: v for k, v in netemExtra.items() if v is not None}
 
         # Optimization: return if nothing else to configure
         # Question: what happens if we want to reset things?
-        if bw is None and not delay and not loss and max_queue_size is None:
+        if (
+            bw is None
+            and not delay
+            and not loss
+            and max_queue_size is None
+            and not netemExtra
+        ):
+            self.netemParent = None
             return None
 
-        # Clear existing configuration
-        tcoutput = self.tc("%s qdisc show dev %s")
-        if "priomap" not in tcoutput and "noqueue" not in tcoutput:
-            cmds = ["%s qdisc del dev %s root"]
-        else:
-            cmds = []
+        # Clear existing configuration. Batched configuration replaces the
+        # root qdisc instead, which saves the round trip for `qdisc show`.
+        cmds = []
+        if batch is None:
+            tcoutput = self.tc("%s qdisc show dev %s")
+            if "priomap" not in tcoutput and "noqueue" not in tcoutput:
+                cmds = ["%s qdisc del dev %s root"]
 
         # Bandwidth limits via various methods
         bwcmds, parent = self.bwCmds(
@@ -408,8 +812,10 @@ class TCIntf(Intf):
             latency_ms=latency_ms,
             enable_ecn=enable_ecn,
             enable_red=enable_red,
+            high_rate=high_rate,
         )
         cmds += bwcmds
+        self.netemParent = parent
 
         # Delay/jitter/loss/max_queue_size using netem
         delaycmds, parent = self.delayCmds(
@@ -418,9 +824,20 @@ class TCIntf(Intf):
             loss=loss,
             max_queue_size=max_queue_size,
             parent=parent,
+            **netemExtra
         )
         cmds += delaycmds
 
+        # Optional fair queueing leaf below the shaper and/or netem
+        if leaf is not None:
+            if leaf not in LEAF_QDISCS:
+                error("Unsupported leaf qdisc", leaf, "- ignoring\n")
+            else:
+                cmds += ["%s qdisc add dev %s" + parent + "handle 20: " + leaf]
+                parent = " parent 20: "
+
+        checkRate = bw is not None and (high_rate or bw > HIGH_RATE_THRESHOLD)
+
         # Ugly but functional: display configuration info
         stuff = (
             (["%.2fMbit" % bw] if bw is not None else [])
@@ -431,6 +848,15 @@ class TCIntf(Intf):
         )
         info("(" + " ".join(stuff) + ") ")
 
+        if batch is not None:
+            if cmds and " root " in cmds[0]:
+                cmds[0] = cmds[0].replace(" qdisc add ", " qdisc replace ", 1)
+            batch.addTC(self, cmds)
+            if checkRate:
+                batch.addRateCheck(self, bw)
+            result["parent"] = parent
+            return result
+
         # Execute all the commands in our node
         debug("at map stage w/cmds: %s\n" % cmds)
         tcoutputs = [self.tc(cmd) for cmd in cmds]
@@ -441,9 +867,169 @@ class TCIntf(Intf):
         debug("outputs:", tcoutputs, "\n")
         result["tcoutputs"] = tcoutputs
         result["parent"] = parent
+        if checkRate:
+            result["rateCheck"] = self.checkProgrammedRate(bw)
 
         return result
 
+    def reshape(self, **params):
+        "Drop any existing qdiscs and apply fresh shaping parameters"
+        with self.shapingLock:
+            self.tc("%s qdisc del dev %s root")
+            return self.config(**params)
+
+    _netemParams = ("delay", "jitter", "loss", "max_queue_size") + netemExtraParams
+    _bwParams = (
+        "bw",
+        "speedup",
+        "use_hfsc",
+        "use_tbf",
+        "latency_ms",
+        "enable_ecn",
+        "enable_red",
+        "high_rate",
+    )
+
+    def changeShapingCmds(self, **changes):
+        """Return (cmds, shaping) to change the live qdisc tree in place.
+        cmds is None if the tree lacks the qdisc that a change needs (e.g.
+        setting bw on an unshaped link) or the change alters its structure
+        (e.g. a new leaf qdisc), so it has to be rebuilt instead."""
+        current = dict(self.shaping or {})
+        merged = dict(current, **changes)
+        hasBw = current.get("bw") is not None
+        hasNetem = any(current.get(k) for k in self._netemParams)
+        wantsNetem = any(k in changes for k in self._netemParams)
+        # Anything but bw and netem (a leaf qdisc, high_rate, ...) changes
+        # the structure of the tree
+        restructures = any(
+            current.get(k) != v
+            for k, v in changes.items()
+            if k != "bw" and k not in self._netemParams
+        )
+
+        if (
+            restructures
+            or ("bw" in changes and not hasBw)
+            or (wantsNetem and not hasNetem and current.get("leaf"))
+        ):
+            return None, merged
+
+        cmds = []
+        if "bw" in changes:
+            bwcmds, _ = self.bwCmds(**{k: merged.get(k) for k in self._bwParams})
+            for cmd in bwcmds:
+                if " class add " in cmd:
+                    cmds.append(cmd.replace(" class add ", " class change ", 1))
+                elif " tbf " in cmd or " handle 6: " in cmd:
+                    cmds.append(cmd.replace(" qdisc add ", " qdisc change ", 1))
+        if wantsNetem:
+            delaycmds, _ = self.delayCmds(
+                parent=self.netemParent or " root ",
+                **{k: merged[k] for k in self._netemParams if merged.get(k) is not None}
+            )
+            # replace changes netem in place, or adds it if it was missing
+            cmds += [c.replace(" qdisc add ", " qdisc replace ", 1) for c in delaycmds]
+        return cmds, merged
+
+    def changeShaping(self, **changes):
+        """Change bw, delay, jitter and/or loss of the live qdisc tree.
+        Uses tc class/qdisc change so queued packets and the rest of the
+        tree survive. Falls back to reshape() if the tree lacks the qdisc
+        that a change needs, or for changes of its structure like leaf."""
+        with self.shapingLock:
+            cmds, merged = self.changeShapingCmds(**changes)
+            if cmds is None:
+                return self.reshape(**merged)
+
+            debug("changing shaping w/cmds: %s\n" % cmds)
+            tcoutputs = [self.tc(cmd) for cmd in cmds]
+            for output in tcoutputs:
+                if output != "":
+                    error("*** Error: %s" % output)
+            self.shaping = merged
+        if "bw" in changes and (merged.get("high_rate") or merged["bw"] > HIGH_RATE_THRESHOLD):
+            self.checkProgrammedRate(merged["bw"])
+        return tcoutputs
+
+
+class TCBatch(object):
+    """Collects ethtool and tc commands from many TCIntfs and applies them
+    with one shell round trip and one `tc -batch` run per namespace.
+
+    Interfaces of nodes that are not in a namespace (switches) all share
+    the root namespace and are applied together. Failing tc lines are
+    mapped back to the interface that queued them."""
+
+    _failedRegex = re.compile(r"Command failed .*:(\d+)")
+
+    def __init__(self, viaShell=True):
+        """viaShell: run through the node's shell (node.cmd); set to False
+        to spawn separate processes (node.pexec), which is safe while other
+        threads use the node's shell."""
+        self.viaShell = viaShell
+        self.groups = {}
+        self.rateChecks = []
+
+    def _group(self, intf):
+        key = intf.node if intf.node.inNamespace else None
+        if key not in self.groups:
+            self.groups[key] = {"node": intf.node, "shell": [], "tc": []}
+        return self.groups[key]
+
+    def addCmd(self, intf, cmd):
+        "Queue a shell command for the interface's namespace"
+        self._group(intf)["shell"].append(cmd)
+
+    def addTC(self, intf, cmds):
+        "Queue tc commands (with %s placeholders for tc and intf)"
+        group = self._group(intf)
+        for cmd in cmds:
+            group["tc"].append((intf, (cmd % ("", intf)).strip()))
+
+    def addRateCheck(self, intf, bw):
+        "Verify the programmed rate of intf once the batch has been applied"
+        self.rateChecks.append((intf, bw))
+
+    def _run(self, node, cmd):
+        if self.viaShell:
+            return node.cmd(cmd)
+        out, err, _ = node.pexec(cmd, shell=True)
+        return out + err
+
+    def apply(self):
+        "Run all queued commands; return a dict of interface name -> errors"
+        errors = {}
+        for group in self.groups.values():
+            node = group["node"]
+            if group["shell"]:
+                self._run(node, "; ".join(group["shell"]))
+            if not group["tc"]:
+                continue
+            with tempfile.NamedTemporaryFile(
+                "w", prefix="netsim-tc-", suffix=".batch"
+            ) as f:
+                f.write("\n".join(cmd for _, cmd in group["tc"]) + "\n")
+                f.flush()
+                debug(" *** executing tc batch on %s: %s\n" % (node, f.name))
+                output = self._run(node, "tc -force -batch %s" % f.name)
+            lines = output.splitlines()
+            for idx, line in enumerate(lines):
+                match = self._failedRegex.search(line)
+                if not match:
+                    continue
+                intf, cmd = group["tc"][int(match.group(1)) - 1]
+                detail = lines[idx - 1] if idx > 0 else line
+                errors.setdefault(intf.name, []).append("%s (%s)" % (detail, cmd))
+        for name, errs in errors.items():
+            for err in errs:
+                error("*** Error: %s: %s\n" % (name, err))
+        for intf, bw in self.rateChecks:
+            intf.checkProgrammedRate(bw)
+        self.groups = {}
+        self.rateChecks = []
+        return errors
+
 
 class Link(object):
     """A basic link is just a veth pair.
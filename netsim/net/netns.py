@@ -0,0 +1,250 @@
+"""Lightweight network backend for plain star topologies.
+
+Builds a StarTopo without the Mininet object: no OVS switch, no
+controller and no waiting for switches to connect. Hosts are still
+mininet Nodes, so every host keeps its shell in its own network
+namespace and the n.cmd / n.popen contract is unchanged. The switch is
+a Linux bridge in the root namespace. All bridges and veth pairs are
+created with a single `ip -batch` run, each end already placed in its
+namespace, and links are then wrapped in TCLinks without creating
+anything, so TCIntf shaping behaves exactly as with Mininet.
+"""
+
+import concurrent.futures
+import random
+import tempfile
+
+from mininet.log import debug, error, info
+from mininet.net import Mininet
+from mininet.node import Host, Switch
+from mininet.util import ipAdd, macColonHex, netParse, quietRun
+
+from net.link import TCLink
+
+# Sim node types the netns backend can build
+NETNS_TYPES = ("public",)
+
+
+def netnsSupported(nodes):
+    "Whether every node group of a case can run on the netns backend"
+    return all(node["type"] in NETNS_TYPES for node in nodes)
+
+
+def randMac():
+    "Random locally administered unicast MAC, as Mininet assigns them"
+    return macColonHex(random.randint(1, 2**48 - 1) & 0xFEFFFFFFFFFF | 0x020000000000)
+
+
+def ipBatch(cmds):
+    """Run ip commands in the root namespace with one `ip -batch`.
+    Returns the output if any command failed, else an empty string."""
+    if not cmds:
+        return ""
+    with tempfile.NamedTemporaryFile("w", prefix="netsim-ip-", suffix=".batch") as f:
+        f.write("\n".join(cmds) + "\n")
+        f.flush()
+        debug("*** executing ip batch %s\n" % f.name)
+        output = quietRun("ip -force -batch %s" % f.name)
+    return output if "Command failed" in output else ""
+
+
+class NetnsBridge(Switch):
+    """Plain Linux bridge in the root namespace, managed with iproute2.
+
+    Like OVS it floods multicast, and bridged traffic bypasses the
+    host's iptables. NetnsNet creates the device and attaches its ports
+    in its own ip batch; under Mininet start() does it."""
+
+    def addCmd(self):
+        "ip batch line creating the bridge device"
+        return (
+            "link add name %s type bridge mcast_snooping 0 "
+            "nf_call_iptables 0 nf_call_ip6tables 0 nf_call_arptables 0" % self.name
+        )
+
+    def start(self, controllers):
+        cmds = [self.addCmd(), "link set dev %s up" % self.name]
+        cmds += [
+            "link set dev %s master %s" % (intf, self.name)
+            for intf in self.intfList()
+            if intf.name != "lo"
+        ]
+        failed = ipBatch(cmds)
+        if failed:
+            error("*** Error starting bridge %s:\n%s" % (self.name, failed))
+
+    def connected(self):
+        return True
+
+    def stop(self, deleteIntfs=True):
+        self.cmd("ip link del dev %s" % self.name)
+        super(NetnsBridge, self).stop(deleteIntfs=False)
+
+
+class NetnsLink(TCLink):
+    "TCLink over a veth pair that NetnsNet has already created"
+
+    @classmethod
+    def makeIntfPair(cls, *args, **kwargs):
+        pass
+
+
+class NetnsNet(object):
+    """Builds and runs a Topo with namespaces, veth pairs and a bridge.
+
+    Offers the part of the Mininet API netsim uses: get(), items(),
+    values(), nameToNode, hosts, switches, start() and stop()."""
+
+    def __init__(self, topo, batch=None, ipBase="10.0.0.0/8", build=True):
+        """topo: Topo to build
+        batch: optional TCBatch the interface shaping is queued on
+        ipBase: subnet host addresses are assigned from, as in Mininet"""
+        Mininet.init()
+        self.topo = topo
+        self.batch = batch
+        self.ipBaseNum, self.prefixLen = netParse(ipBase)
+        hostIP = (0xFFFFFFFF >> self.prefixLen) & self.ipBaseNum
+        self.nextIP = hostIP if hostIP > 0 else 1
+        self.hosts = []
+        self.switches = []
+        self.controllers = []
+        self.links = []
+        self.nameToNode = {}
+        if build:
+            self.build()
+
+    def hostParams(self, name):
+        "Node parameters with the default IP Mininet would assign"
+        params = {
+            "ip": ipAdd(self.nextIP, ipBaseNum=self.ipBaseNum, prefixLen=self.prefixLen)
+            + "/%s" % self.prefixLen
+        }
+        self.nextIP += 1
+        params.update(self.topo.nodeInfo(name))
+        return params
+
+    def startNodes(self):
+        "Start every node's shell, concurrently"
+        specs = []
+        for name in self.topo.hosts():
+            params = self.hostParams(name)
+            specs.append((name, params.pop("cls", Host), params))
+        for name in self.topo.switches():
+            params = dict(self.topo.nodeInfo(name))
+            params.pop("cls", None)
+            specs.append((name, NetnsBridge, params))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(specs)) as executor:
+            futures = [
+                executor.submit(cls, name, **params) for name, cls, params in specs
+            ]
+        for (name, cls, _), future in zip(specs, futures):
+            node = future.result()
+            self.nameToNode[name] = node
+            (self.switches if cls is NetnsBridge else self.hosts).append(node)
+
+    def linkSpecs(self):
+        "Resolve topology links to nodes, ports, interface names and MACs"
+        specs = []
+        for _, _, params in self.topo.links(sort=True, withInfo=True):
+            params = dict(params)
+            node1 = self.nameToNode[params.pop("node1")]
+            node2 = self.nameToNode[params.pop("node2")]
+            # Named like Link.intfName names them under Mininet
+            params.setdefault("intfName1", "%s-e%d" % (node1.name, params["port1"]))
+            params.setdefault("intfName2", "%s-e%d" % (node2.name, params["port2"]))
+            params.setdefault("addr1", randMac())
+            params.setdefault("addr2", randMac())
+            specs.append((node1, node2, params))
+        return specs
+
+    def build(self):
+        self.startNodes()
+        specs = self.linkSpecs()
+
+        cmds = []
+        for switch in self.switches:
+            cmds.append(switch.addCmd())
+            cmds.append("link set dev %s up" % switch)
+        for node1, node2, params in specs:
+            ends = []
+            for node, name, addr in (
+                (node1, params["intfName1"], params["addr1"]),
+                (node2, params["intfName2"], params["addr2"]),
+            ):
+                netns = " netns %d" % node.pid if node.inNamespace else ""
+                ends.append("name %s address %s%s" % (name, addr, netns))
+            cmds.append("link add %s type veth peer %s" % tuple(ends))
+            for node, name in (
+                (node1, params["intfName1"]),
+                (node2, params["intfName2"]),
+            ):
+                if isinstance(node, NetnsBridge):
+                    cmds.append("link set dev %s master %s" % (name, node))
+        failed = ipBatch(cmds)
+        if failed:
+            raise Exception("Error creating bridges and veth pairs:\n%s" % failed)
+
+        for node1, node2, params in specs:
+            self.links.append(NetnsLink(node1, node2, batch=self.batch, **params))
+
+        def configHost(host):
+            if host.defaultIntf():
+                host.configDefault()
+            else:
+                host.configDefault(ip=None, mac=None)
+            host.cmd("ip link set dev lo up")
+
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.hosts)
+        ) as executor:
+            list(executor.map(configHost, self.hosts))
+
+    def start(self):
+        "Bridges are already forwarding once build() returns"
+        info("*** %s bridges ready\n" % len(self.switches))
+
+    def stop(self):
+        # Deleting the root namespace end removes the whole veth pair
+        failed = ipBatch(
+            [
+                "link del dev %s" % intf
+                for link in self.links
+                for intf in (link.intf1, link.intf2)
+                if not intf.node.inNamespace
+            ]
+        )
+        if failed:
+            error("*** Error deleting veth pairs:\n%s" % failed)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=len(self.hosts)
+        ) as executor:
+            list(executor.map(lambda host: host.terminate(), self.hosts))
+        for switch in self.switches:
+            switch.stop()
+            switch.terminate()
+
+    def get(self, *args):
+        "Return node(s) with given name(s)"
+        if len(args) == 1:
+            return self.nameToNode[args[0]]
+        return [self.nameToNode[name] for name in args]
+
+    def __getitem__(self, key):
+        return self.nameToNode[key]
+
+    def __contains__(self, item):
+        return item in self.nameToNode
+
+    def __iter__(self):
+        for node in self.hosts + self.switches:
+            yield node.name
+
+    def keys(self):
+        return list(self)
+
+    def values(self):
+        return [self[key] for key in self]
+
+    def items(self):
+        return [(key, self[key]) for key in self]
@@ -1,6 +1,117 @@
+import concurrent.futures
+
 from mininet.topo import Topo
-from mininet.nodelib import NAT
-from mininet.node import Node
+from mininet.nodelib import LinuxBridge, NAT
+from mininet.node import DefaultController, Node, OVSBridge, OVSKernelSwitch
+
+from net.link import LEAF_QDISCS, TCIntf
+from net.netns import NetnsBridge
+from net.trace import initialParams, linkTraces
+
+
+# Keys of a sim JSON link profile and the TCIntf parameter they map to
+LINK_PROFILE_KEYS = {
+    "loss": "loss",
+    "latency": "delay",
+    "bw": "bw",
+    "jitter": "jitter",
+    "high_rate": "high_rate",
+    "leaf": "leaf",
+    "loss_model": "loss_model",
+    "reorder": "reorder",
+    "duplicate": "duplicate",
+    "corrupt": "corrupt",
+    "rate": "rate",
+    "distribution": "distribution",
+}
+
+
+# Switch backends a sim can select for its switches: (class, controller)
+SWITCHES = {
+    # Mininet's default, OVS driven by a reference controller
+    "ovs": (OVSKernelSwitch, DefaultController),
+    # OVS kernel datapath in standalone mode, no controller
+    "ovsbridge": (OVSBridge, None),
+    # Linux bridge managed with brctl
+    "linuxbridge": (LinuxBridge, None),
+    # Linux bridge managed with iproute2, as used by the netns backend
+    "bridge": (NetnsBridge, None),
+}
+DEFAULT_SWITCH = "ovs"
+
+
+def switchBackend(name):
+    "Return (switch class, controller) for a sim's switch setting"
+    if name not in SWITCHES:
+        raise ValueError(
+            "Unknown switch '%s'. Available switches: %s" % (name, ", ".join(SWITCHES))
+        )
+    return SWITCHES[name]
+
+
+def linkParams(profile):
+    """Translate a sim JSON link profile into TCIntf parameters."""
+    return {
+        param: profile[key]
+        for key, param in LINK_PROFILE_KEYS.items()
+        if key in profile
+    }
+
+
+def linkDirections(link):
+    """Return (up, down) TCIntf parameters for a sim JSON link block.
+
+    "up" shapes traffic leaving the host and "down" traffic towards it.
+    Keys set directly on the link block apply to both directions, then
+    the first values of a direction's trace, then its own profile."""
+    shared = linkParams(link)
+    upTrace, downTrace = linkTraces(link)
+    up = dict(shared, **(initialParams(upTrace) if upTrace else {}))
+    up.update(linkParams(link.get("up", {})))
+    down = dict(shared, **(initialParams(downTrace) if downTrace else {}))
+    down.update(linkParams(link.get("down", {})))
+    return up, down
+
+
+def validateLink(link):
+    """Raise ValueError if a sim JSON link block cannot be applied.
+
+    Runs the same argument builders TCIntf uses, so bad impairment
+    settings or values of the wrong type are reported before any
+    network is built."""
+    for direction, params in zip(("up", "down"), linkDirections(link)):
+        try:
+            if "bw" in params and not (
+                TCIntf._number(params["bw"]) and 0 < params["bw"] <= TCIntf.bwParamMax
+            ):
+                raise ValueError(
+                    "Bandwidth limit %r must be Mbit/s in 0..%d"
+                    % (params["bw"], TCIntf.bwParamMax)
+                )
+            if not isinstance(params.get("high_rate", False), bool):
+                raise ValueError("high_rate %r must be true or false" % params["high_rate"])
+            if params.get("leaf") not in (None,) + LEAF_QDISCS:
+                raise ValueError("Unsupported leaf qdisc %r" % (params["leaf"],))
+            TCIntf.netemArgs(
+                **{k: params[k] for k in TCIntf._netemParams if k in params}
+            )
+        except ValueError as e:
+            raise ValueError("Invalid %s link profile: %s" % (direction, e))
+
+
+# Keys of a set_link action besides the link profile keys
+SET_LINK_KEYS = ("action", "delay", "interface", "up", "down")
+
+
+def validateLinkChange(action):
+    """Raise ValueError if a set_link action cannot be applied to a live
+    link: unknown keys, traces or any value validateLink rejects."""
+    unknown = set(action) - set(SET_LINK_KEYS) - set(LINK_PROFILE_KEYS)
+    for direction in ("up", "down"):
+        unknown |= set(action.get(direction, {})) - set(LINK_PROFILE_KEYS)
+    if unknown:
+        raise ValueError("Unknown set_link keys %s" % ", ".join(sorted(unknown)))
+    validateLink(action)
 
 
 class StarTopo(Topo):
@@ -20,12 +131,15 @@ class StarTopo(Topo):
         ],
         runner_id=0,
         interconnect="s1",
+        multicast=False,
     ):
 
         self.runner_id = runner_id
         routerName = "r0_" + str(runner_id)
-        defaultIP = "10.0.0.1/8"  # IP address for r0-eth1
-        router = self.addNode(routerName, cls=LinuxRouter, ip="10.1.1.1")
+        defaultIP = "10.0.0.1/8"  # IP address of the router's first interface
+        router = self.addNode(
+            routerName, cls=LinuxRouter, ip="10.1.1.1", multicast=multicast
+        )
         interconnect = self.addSwitch(interconnect + "-r" + str(runner_id))
 
         self.addLink(
@@ -43,12 +157,10 @@ class StarTopo(Topo):
                         "%s_%d_r%d" % (node["name"], i, runner_id),
                         cls=EdgeNode,
                         defaultRoute="via 10.1.1.1",
+                        multicast=multicast,
                     )
                     if "link" in node:
-                        loss = node["link"]["loss"]
-                        latency = node["link"]["latency"]
-                        bw = node["link"]["bw"]
-                        self.addLink(interconnect, h, loss=loss, delay=latency, bw=bw)
+                        self.addHostLink(h, interconnect, node["link"])
                     else:
                         self.addLink(interconnect, h)
 
@@ -81,10 +193,7 @@ class StarTopo(Topo):
                         defaultRoute="via %s" % localIP,
                     )
                     if "link" in node:
-                        loss = node["link"]["loss"]
-                        latency = node["link"]["latency"]
-                        bw = node["link"]["bw"]
-                        self.addLink(host, switch, loss=loss, delay=latency, bw=bw)
+                        self.addHostLink(host, switch, node["link"])
                     else:
                         self.addLink(host, switch)
 
@@ -146,11 +255,8 @@ class StarTopo(Topo):
 
                     # Connect host to both NAT switches
                     if "link" in node:
-                        loss = node["link"]["loss"]
-                        latency = node["link"]["latency"]
-                        bw = node["link"]["bw"]
-                        self.addLink(host, switch1, loss=loss, delay=latency, bw=bw)
-                        self.addLink(host, switch2, loss=loss, delay=latency, bw=bw)
+                        self.addHostLink(host, switch1, node["link"])
+                        self.addHostLink(host, switch2, node["link"])
                     else:
                         self.addLink(host, switch1)
                         self.addLink(host, switch2)
@@ -160,27 +266,61 @@ class StarTopo(Topo):
             cls=EdgeNode,
             ip="10.1.1.2",
             defaultRoute="via 10.1.1.1",
+            multicast=multicast,
         )  # creates a dedicated node to play around
         self.addLink(interconnect, box)
 
+    def addHostLink(self, host, switch, link):
+        "Connect host to switch, shaping each direction by its link profile"
+        up, down = linkDirections(link)
+        return self.addLink(host, switch, params1=up, params2=down)
+
+
+def waitSmcroute(node, attempts=100, interval=0.02):
+    "Block until the node's smcrouted answers on its control socket"
+    node.cmd(
+        "for i in $(seq %d); do smcroutectl -I smcroute-%s show >/dev/null 2>&1"
+        " && break; sleep %s; done" % (attempts, node.name, interval)
+    )
+
+
+def startMulticast(net):
+    """Finish multicast setup on all nodes that opted in, concurrently.
+
+    Node config only launches smcrouted; joining groups and adding routes
+    has to wait for the daemon, which is done here in parallel instead of
+    sleeping inside each node's serial config step."""
+    nodes = [n for n in net.values() if getattr(n, "multicast", False)]
+    if not nodes:
+        return
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        list(executor.map(lambda n: n.joinMulticast(), nodes))
+
 
 "A Node with multicast stuff."
 
 
 class EdgeNode(Node):
-    def config(self, **params):
+    def config(self, multicast=False, **params):
         super(EdgeNode, self).config(**params)
+        self.multicast = multicast
+        if not multicast:
+            return
         intfName = self.intfNames()[0]
         self.cmd("sysctl net.ipv4.icmp_echo_ignore_broadcasts=0")
         self.cmd("route add -net 224.0.0.0 netmask 240.0.0.0 dev " + intfName)
         self.cmd("smcrouted -l debug -I smcroute-" + self.name)
-        self.cmd("sleep 1")
+
+    def joinMulticast(self):
+        intfName = self.intfNames()[0]
+        waitSmcroute(self)
         self.cmd(
             "smcroutectl -I smcroute-" + self.name + " join " + intfName + " 239.0.0.1"
         )
 
     def terminate(self):
-        self.cmd("smcroutectl -I smcroute-" + self.name + " kill")
+        if getattr(self, "multicast", False):
+            self.cmd("smcroutectl -I smcroute-" + self.name + " kill")
         super(EdgeNode, self).terminate()
 
 
@@ -188,27 +328,36 @@ class EdgeNode(Node):
 
 
 class LinuxRouter(Node):
-    def config(self, **params):
+    def config(self, multicast=False, **params):
         super(LinuxRouter, self).config(**params)
+        self.multicast = multicast
         # Enable forwarding on the router
         self.cmd("sysctl net.ipv4.ip_forward=1")
+        if not multicast:
+            return
         self.cmd("sysctl net.ipv4.icmp_echo_ignore_broadcasts=0")
-        self.cmd("sysctl net.ipv4.conf." + self.name + "-eth1.force_igmp_version=2")
+        self.cmd(
+            "sysctl net.ipv4.conf." + self.intfNames()[0] + ".force_igmp_version=2"
+        )
         self.cmd("smcrouted -l debug -I smcroute-" + self.name)
-        self.cmd("sleep 1")
+
+    def joinMulticast(self):
+        "Forward the group from the first interface out of all the others"
+        inbound, outbound = self.intfNames()[0], self.intfNames()[1:]
+        if not outbound:
+            return
+        waitSmcroute(self)
         self.cmd(
             "smcroutectl -I smcroute-"
             + self.name
             + " add "
-            + self.name
-            + "-eth1 239.0.0.1 "
-            + self.name
-            + "-eth2 "
-            + self.name
-            + "-eth3"
+            + inbound
+            + " 239.0.0.1 "
+            + " ".join(outbound)
         )
 
     def terminate(self):
         self.cmd("sysctl net.ipv4.ip_forward=0")
-        self.cmd("smcroutectl -I smcroute-" + self.name + " kill")
+        if getattr(self, "multicast", False):
+            self.cmd("smcroutectl -I smcroute-" + self.name + " kill")
         super(LinuxRouter, self).terminate()
@@ -0,0 +1,171 @@
+import json
+import os
+import threading
+
+from mininet.log import info
+
+from net.network import DEFAULT_SWITCH, linkDirections
+
+# Node types whose state cannot be reset cheaply between cases. NAT nodes
+# live in the root namespace and keep conntrack mappings around, which
+# would leak between integration cases.
+UNPOOLED_TYPES = ("nat", "multi_nat")
+
+# Long-lived helpers started by node config that must survive a reset.
+KEEP_PROCESSES = ("smcrouted",)
+
+
+def topology_signature(nodes, multicast=False, switch=DEFAULT_SWITCH):
+    """Return a key that is equal for cases that can share a network.
+
+    Host counts and link parameters are left out: counts are covered by
+    sizing the pooled network for the largest case and link shaping is
+    reapplied on every reset."""
+    shape = [(node["name"], node["type"]) for node in nodes]
+    return json.dumps([shape, bool(multicast), switch])
+
+
+def is_poolable(nodes):
+    return not any(node["type"] in UNPOOLED_TYPES for node in nodes)
+
+
+def link_params(node):
+    """(up, down) TCIntf parameters for a node group's link, as StarTopo applies them."""
+    if "link" not in node:
+        return {}, {}
+    return linkDirections(node["link"])
+
+
+def namespace_pids(pid):
+    """Return pids of all processes sharing the network namespace of pid."""
+    try:
+        target = os.readlink(f"/proc/{pid}/ns/net")
+    except OSError:
+        return []
+    if target == os.readlink("/proc/self/ns/net"):
+        # Never sweep the root namespace
+        return []
+    pids = []
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            if os.readlink(f"/proc/{entry}/ns/net") == target:
+                pids.append(int(entry))
+        except OSError:
+            continue
+    return pids
+
+
+def process_name(pid):
+    try:
+        with open(f"/proc/{pid}/comm", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class TopologyPool:
+    """Keeps one started network per runner slot alive between cases.
+
+    A case whose topology signature matches the network already running
+    in its slot gets that network back after a reset of processes, links,
+    addresses, routes and tc qdiscs. Otherwise the old network is stopped
+    and a new one is built, sized for the largest case of that shape."""
+
+    def __init__(self, cases, build):
+        self.build = build
+        self.capacity = {}
+        self.nets = {}
+        self.lock = threading.Lock()
+        for case in cases:
+            nodes = case["nodes"]
+            signature = topology_signature(
+                nodes, case.get("multicast", False), case.get("switch", DEFAULT_SWITCH)
+            )
+            counts = self.capacity.setdefault(signature, {})
+            for node in nodes:
+                counts[node["name"]] = max(counts.get(node["name"], 0), int(node["count"]))
+
+    def sized(self, nodes, signature):
+        counts = self.capacity.get(signature, {})
+        return [
+            dict(node, count=max(int(node["count"]), counts.get(node["name"], 0)))
+            for node in nodes
+        ]
+
+    def acquire(self, nodes, runner_id, multicast=False, switch=DEFAULT_SWITCH):
+        """Return a started network for nodes on runner_id."""
+        if not is_poolable(nodes):
+            self.discard(runner_id)
+            return self.build(nodes, runner_id, multicast, switch=switch)
+
+        signature = topology_signature(nodes, multicast, switch)
+        with self.lock:
+            entry = self.nets.get(runner_id)
+        if entry and entry[0] == signature:
+            info(f"Reusing warm topology for runner {runner_id}\n")
+            reset_network(entry[1], nodes, runner_id)
+            return entry[1]
+
+        self.discard(runner_id)
+        net = self.build(
+            self.sized(nodes, signature), runner_id, multicast, switch=switch
+        )
+        with self.lock:
+            self.nets[runner_id] = (signature, net)
+        return net
+
+    def owns(self, net):
+        with self.lock:
+            return any(entry[1] is net for entry in self.nets.values())
+
+    def discard(self, runner_id):
+        with self.lock:
+            entry = self.nets.pop(runner_id, None)
+        if entry:
+            entry[1].stop()
+
+    def close(self):
+        with self.lock:
+            runner_ids = list(self.nets)
+        for runner_id in runner_ids:
+            self.discard(runner_id)
+
+
+def reset_network(net, nodes, runner_id):
+    """Bring the hosts of a pooled network back to their freshly built state."""
+    for node in nodes:
+        params = link_params(node)
+        i = 0
+        while True:
+            host = net.nameToNode.get(f'{node["name"]}_{i}_r{runner_id}')
+            if host is None:
+                break
+            reset_host(host, params)
+            i += 1
+
+
+def reset_host(host, params):
+    up, down = params
+    for pid in namespace_pids(host.pid):
+        if pid != host.pid and process_name(pid) not in KEEP_PROCESSES:
+            try:
+                os.kill(pid, 9)
+            except OSError:
+                pass
+
+    for intf in host.intfList():
+        if intf.link is None:
+            continue
+        host.cmd(f"ip link set {intf.name} up")
+        if intf.ip and intf.prefixLen:
+            host.cmd(f"ip addr flush dev {intf.name}")
+            host.cmd(f"ip addr add {intf.ip}/{intf.prefixLen} dev {intf.name}")
+        for end in (intf.link.intf1, intf.link.intf2):
+            if hasattr(end, "reshape"):
+                end.reshape(**(up if end.node is host else down))
+
+    default_route = host.params.get("defaultRoute")
+    if default_route:
+        host.setDefaultRoute(default_route)
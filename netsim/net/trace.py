@@ -0,0 +1,209 @@
+"""Trace-driven link emulation.
+
+A trace is a CSV file with a header row and one row per step:
+
+    time_ms,bw,delay_ms,loss,jitter_ms
+    0,50,40,0.1,5
+    50,12,60,0.5,
+    ...
+
+time_ms is the offset from the start of the case. All other columns are
+optional, and an empty cell keeps the previous value. bw is in Mbit/s
+and loss in percent. With "trace_loop": true on the link block the trace
+restarts when it runs out, otherwise the last step stays in effect.
+"""
+
+import contextlib
+import csv
+import heapq
+import threading
+import time
+
+from mininet.log import error
+
+from net.link import TCBatch
+
+# CSV column -> (TCIntf parameter, converter)
+TRACE_COLUMNS = {
+    "bw": ("bw", float),
+    "delay_ms": ("delay", lambda v: "%sms" % float(v)),
+    "loss": ("loss", float),
+    "jitter_ms": ("jitter", lambda v: "%sms" % float(v)),
+}
+
+_traces = {}
+_tracesLock = threading.Lock()
+
+
+def loadTrace(path):
+    """Return the steps of a trace file as a list of (seconds, params)."""
+    with _tracesLock:
+        if path in _traces:
+            return _traces[path]
+    steps = []
+    with open(path, "r", newline="") as f:
+        reader = csv.DictReader(f)
+        if not reader.fieldnames or "time_ms" not in reader.fieldnames:
+            raise ValueError("Trace %s has no time_ms column" % path)
+        for lineno, row in enumerate(reader, start=2):
+            try:
+                params = {
+                    param: convert(row[column])
+                    for column, (param, convert) in TRACE_COLUMNS.items()
+                    if row.get(column) not in (None, "")
+                }
+                steps.append((float(row["time_ms"]) / 1000.0, params))
+            except ValueError as e:
+                raise ValueError("Trace %s line %d: %s" % (path, lineno, e))
+    if not steps:
+        raise ValueError("Trace %s is empty" % path)
+    steps.sort(key=lambda step: step[0])
+    with _tracesLock:
+        _traces[path] = steps
+    return steps
+
+
+def linkTraces(link):
+    """Return the (up, down) trace paths of a sim JSON link block.
+
+    A "trace" on the link block drives both directions and a "trace" in
+    the "up"/"down" profile overrides it for that direction."""
+    shared = link.get("trace")
+    up = link.get("up", {}).get("trace", shared)
+    down = link.get("down", {}).get("trace", shared)
+    return up, down
+
+
+def initialParams(path):
+    """Shaping a traced link starts with, so the qdisc tree exists up front."""
+    params = {}
+    for _, step in loadTrace(path):
+        for key, value in step.items():
+            params.setdefault(key, value)
+    return params
+
+
+def tracePeriod(steps):
+    "Length of one pass through a trace when it is looped"
+    if len(steps) < 2:
+        return steps[-1][0] or 1.0
+    return steps[-1][0] + (steps[-1][0] - steps[-2][0])
+
+
+class TraceReplayer(object):
+    """Drives the shaping of traced interfaces on schedule.
+
+    All steps due at the same time are applied together, with one
+    `tc -batch` per namespace. Every step is recorded in self.schedule
+    with its planned and actual offset, including steps that could not
+    be applied in place, which carry an error."""
+
+    def __init__(self, targets):
+        """targets: list of (node name, direction, intf, trace path, loop)"""
+        self.schedule = []
+        self.events = []
+        self.periods = {}
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.start = None
+        seq = 0
+        for nodeName, direction, intf, path, loop in targets:
+            steps = loadTrace(path)
+            self.periods[path] = tracePeriod(steps)
+            for offset, params in steps:
+                self.events.append(
+                    (offset, seq, nodeName, direction, intf, path, loop, params)
+                )
+                seq += 1
+        self.seq = seq
+        heapq.heapify(self.events)
+
+    def begin(self):
+        self.start = time.monotonic()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while self.events and not self.stopEvent.is_set():
+            due = self.events[0][0]
+            if self.stopEvent.wait(max(0.0, self.start + due - time.monotonic())):
+                break
+            batch = TCBatch(viaShell=False)
+            steps = []
+            # Keep set_link and pool resets off these interfaces until
+            # the batch has run and intf.shaping matches the qdiscs
+            with contextlib.ExitStack() as locks:
+                while self.events and self.events[0][0] <= due:
+                    event = heapq.heappop(self.events)
+                    offset, _, nodeName, direction, intf, path, loop, params = event
+                    if loop:
+                        self.seq += 1
+                        heapq.heappush(
+                            self.events,
+                            (offset + self.periods[path], self.seq) + event[2:],
+                        )
+                    locks.enter_context(intf.shapingLock)
+                    cmds, shaping = intf.changeShapingCmds(**params)
+                    if cmds is None:
+                        error("*** Trace step on %s needs a full reshape - skipped\n" % intf)
+                        steps.append((offset, nodeName, direction, intf, params, False))
+                        continue
+                    batch.addTC(intf, cmds)
+                    intf.shaping = shaping
+                    steps.append((offset, nodeName, direction, intf, params, True))
+                appliedAt = time.monotonic() - self.start
+                errors = batch.apply()
+            for offset, nodeName, direction, intf, params, inPlace in steps:
+                if inPlace:
+                    stepErrors = errors.get(intf.name, [])
+                else:
+                    stepErrors = ["needs a full reshape - skipped"]
+                self.schedule.append(
+                    {
+                        "node": nodeName,
+                        "interface": intf.name,
+                        "direction": direction,
+                        "scheduled": round(offset, 6),
+                        "applied": round(appliedAt, 6),
+                        "params": params,
+                        "errors": stepErrors,
+                    }
+                )
+
+    def summary(self):
+        lateness = [s["applied"] - s["scheduled"] for s in self.schedule]
+        return {
+            "steps": len(self.schedule),
+            "failed_steps": sum(1 for s in self.schedule if s["errors"]),
+            "max_lateness_ms": round(max(lateness) * 1000, 3) if lateness else 0,
+        }
+
+
+def traceTargets(net, nodes, runner_id):
+    """Collect replay targets for every traced host link."""
+    targets = []
+    for node in nodes:
+        if "link" not in node:
+            continue
+        up, down = linkTraces(node["link"])
+        if not up and not down:
+            continue
+        loop = node["link"].get("trace_loop", False)
+        for i in range(int(node["count"])):
+            nodeName = f'{node["name"]}_{i}_r{runner_id}'
+            host = net.get(nodeName)
+            for intf in host.intfList():
+                if intf.link is None:
+                    continue
+                peer = intf.link.intf2 if intf.link.intf1 is intf else intf.link.intf1
+                if up:
+                    targets.append((nodeName, "up", intf, up, loop))
+                if down:
+                    targets.append((nodeName, "down", peer, down, loop))
+    return targets
@@ -1,6 +1,7 @@
 import json
 import re
 import os
+import threading
 import humanfriendly
 
 invalid_results = {
@@ -158,16 +159,152 @@ def aggregate_stats(stats):
     return summed, avg
 
 
-def write_report(prefix, name, stats):
+def shaping_summary(checks, avg):
+    """Relate measured throughput to the configured link rate."""
+    configured = min(c["configured_mbits"] for c in checks)
+    return {
+        "links": checks,
+        "all_ok": all(c["ok"] for c in checks),
+        "ceiling_ratio": avg["mbits"] / configured if configured else 0,
+    }
+
+
+# Raw throughput each switch backend reached in the calibration sim
+CEILINGS_PATH = "logs/switch_ceilings.json"
+_ceilings_lock = threading.Lock()
+
+
+def load_ceilings():
+    """Return the measured ceilings by switch backend, if calibrated."""
+    try:
+        with open(CEILINGS_PATH, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def record_ceiling(switch, reports):
+    """Store the best throughput of a calibration case as its switch's ceiling."""
+    mbits = max(report["sum"]["mbits"] for report in reports.values())
+    if mbits <= 0:
+        return
+    with _ceilings_lock:
+        ceilings = load_ceilings()
+        ceilings[switch] = {"mbits": mbits}
+        with open(CEILINGS_PATH, "w") as f:
+            json.dump(ceilings, f, indent=4)
+
+
+def usage_totals(usages):
+    """Sum cgroup CPU times and take the largest memory peak."""
+    totals = {}
+    for usage in usages:
+        for key, value in usage.items():
+            if key == "memory_peak":
+                totals[key] = max(totals.get(key, 0), value)
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def group_nodes(per_node, name):
+    """Entries of a per-instance dict that belong to node group name."""
+    return {
+        node_name: value
+        for node_name, value in per_node.items()
+        if node_name.rsplit("_", 2)[0] == name
+    }
+
+
+def resource_summary(resources, name, summed):
+    """CPU and memory of a node group and of the whole case.
+
+    cpu_seconds_per_gb relates the CPU time of every node in the case,
+    senders and receivers alike, to the data this group transferred."""
+    nodes = group_nodes(resources, name)
+    case = usage_totals(resources.values())
+    summary = {
+        "nodes": nodes,
+        "group": usage_totals(nodes.values()),
+        "case": case,
+    }
+    gigabytes = summed["data_len"] / 1e9
+    if gigabytes > 0 and "usage_usec" in case:
+        summary["cpu_seconds_per_gb"] = case["usage_usec"] / 1e6 / gigabytes
+    return summary
+
+
+def wire_summary(interfaces, name, summed):
+    """Traffic on a node group's interfaces, as the kernel counted it.
+
+    The busier direction is taken as the transfer: goodput_mbits is its
+    rate while the interfaces carried traffic, and overhead_ratio relates
+    its bytes to the data the application reported."""
+    intfs = {
+        intf: counters
+        for intf, counters in interfaces.items()
+        if counters["node"].rsplit("_", 2)[0] == name
+    }
+    totals = {}
+    for counters in intfs.values():
+        for key, value in counters.items():
+            if key not in ("node", "active_s") and not key.startswith("peak_"):
+                totals[key] = totals.get(key, 0) + value
+    summary = {"interfaces": intfs, "total": totals}
+    wire_bytes = max(totals.get("rx_bytes", 0), totals.get("tx_bytes", 0))
+    active = max((c["active_s"] for c in intfs.values()), default=0)
+    if active > 0:
+        summary["goodput_mbits"] = wire_bytes * 8 / active / 1e6
+    if summed["data_len"] > 0:
+        summary["overhead_ratio"] = wire_bytes / summed["data_len"]
+    return summary
+
+
+def write_report(prefix, name, stats, case_info=None):
     """Write stats to a report file."""
     summed, avg = aggregate_stats(stats)
     report = {"raw": stats, "sum": summed, "avg": avg}
+    if case_info:
+        timings = case_info.get("timings", {})
+        report["timings"] = {k: round(v, 4) for k, v in timings.items()}
+        checks = case_info.get("shaping", {}).get(name)
+        if checks:
+            report["shaping"] = shaping_summary(checks, avg)
+        actions = {}
+        for action in case_info.get("actions", []):
+            actions.setdefault(action["node"], []).append(action)
+        if actions:
+            report["actions"] = actions
+        if "link_trace" in case_info:
+            report["link_trace"] = case_info["link_trace"]
+        if "cgroup" in case_info:
+            report["cgroup"] = case_info["cgroup"]
+        if case_info.get("resources"):
+            report["resources"] = resource_summary(
+                case_info["resources"], name, summed
+            )
+        if case_info.get("interfaces"):
+            report["wire"] = wire_summary(case_info["interfaces"], name, summed)
+        proc = group_nodes(case_info.get("proc", {}), name)
+        if proc:
+            report["proc"] = proc
+        switch = case_info.get("switch")
+        ceiling = load_ceilings().get(switch)
+        if ceiling and ceiling["mbits"] > 0:
+            report["emulator_ceiling"] = {
+                "switch": switch,
+                "mbits": ceiling["mbits"],
+                "ratio": summed["mbits"] / ceiling["mbits"],
+            }
     with open(f"report/{prefix}__{name}.json", "w") as f:
         json.dump(report, f, indent=4)
+    return report
+
 
+def process_logs(nodes, prefix, runner_id, case_info=None):
+    """Process logs based on provided nodes and parsers.
 
-def process_logs(nodes, prefix, runner_id):
-    """Process logs based on provided nodes and parsers."""
+    Returns the written reports by node group name."""
     valid_parsers = {
         "iperf_server": parse_iperf,
         "iperf_udp_server": parse_iperf,
@@ -179,6 +316,7 @@ def process_logs(nodes, prefix, runner_id):
         # JSON-based parsers (preferred)
         "iroh_json": lambda lines: [parse_iroh_json_output(lines)],
     }
+    reports = {}
     for node in nodes:
         parser_name = node.get("parser", "")
         is_valid = (
@@ -208,7 +346,8 @@ def process_logs(nodes, prefix, runner_id):
                 except Exception as e:
                     print(f"Error processing {log_path}: {e}")
                     stats = [invalid_results]
-            write_report(prefix, node["name"], stats)
+            reports[node["name"]] = write_report(prefix, node["name"], stats, case_info)
+    return reports
 
 
 def process_integration_logs(nodes, prefix, runner_id):
@@ -19,6 +19,11 @@ def res_to_prom(res, commit):
             labels = format_labels(commit, test_name, case)
             print_metric("throughput", labels, metrics["throughput"])
             print_metric("reported_throughput", labels, metrics["reported_throughput"])
+            if "ceiling_ratio" in metrics:
+                print_metric("emulator_ceiling_ratio", labels, metrics["ceiling_ratio"])
+            for metric in ("cpu_seconds_per_gb", "memory_peak_mb", "wire_goodput", "overhead_ratio"):
+                if metric in metrics:
+                    print_metric(metric, labels, metrics[metric])
 
 
 case_order = [
@@ -102,6 +107,13 @@ def res_to_metro(res, commit, integration):
                         now,
                     )
                 )
+                for metric in ("cpu_seconds_per_gb", "memory_peak_mb", "wire_goodput", "overhead_ratio"):
+                    if metric in metrics:
+                        r["metrics"].append(
+                            create_metric(
+                                commit, bucket, metric, tag, metrics[metric], now
+                            )
+                        )
                 if suffix == "":
                     # Report times
                     r["metrics"].extend(
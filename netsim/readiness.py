@@ -0,0 +1,82 @@
+import re
+import time
+
+from mininet.log import error
+
+from util import FileWatcher, LogTailer
+
+DEFAULT_READY_TIMEOUT = 10
+PORT_POLL_INTERVAL = 0.05
+
+
+def probe_log(node, instances, prefix, timeout):
+    """Ready once every instance log contains a line matching `pattern`."""
+    pattern = re.compile(node["ready"]["pattern"])
+    log_files = {name: f"logs/{prefix}__{name}.txt" for name, _ in instances}
+    tailers = {name: LogTailer(path) for name, path in log_files.items()}
+    pending = set(log_files)
+    watcher = FileWatcher(log_files.values())
+    deadline = time.monotonic() + timeout
+    try:
+        while pending:
+            for name in list(pending):
+                if any(pattern.search(line) for line in tailers[name].read_lines()):
+                    pending.discard(name)
+            remaining = deadline - time.monotonic()
+            if not pending or remaining <= 0:
+                break
+            watcher.wait(remaining)
+    finally:
+        watcher.close()
+    return sorted(pending)
+
+
+def probe_port(node, instances, prefix, timeout):
+    """Ready once every instance has a socket bound to `port` in its namespace."""
+    ready = node["ready"]
+    proto = ready.get("proto", "tcp")
+    if proto not in ("tcp", "udp"):
+        raise ValueError(f"Unsupported readiness probe protocol '{proto}'")
+    flag = "-t" if proto == "tcp" else "-u"
+    state = "-l" if proto == "tcp" else "-a"
+    cmd = f"ss -Hn {flag} {state} 'sport = :{int(ready['port'])}'"
+    pending = dict(instances)
+    deadline = time.monotonic() + timeout
+    while pending:
+        for name, n in list(pending.items()):
+            if n.cmd(cmd).strip():
+                del pending[name]
+        if not pending or time.monotonic() >= deadline:
+            break
+        time.sleep(PORT_POLL_INTERVAL)
+    return sorted(pending)
+
+
+READINESS_PROBES = {
+    "log": probe_log,
+    "port": probe_port,
+}
+
+
+def validate_probe(node):
+    """Raise if the node group declares an unknown readiness probe."""
+    if "ready" not in node:
+        return
+    probe = node["ready"].get("probe")
+    if probe not in READINESS_PROBES:
+        raise ValueError(
+            f"Unknown readiness probe '{probe}' for node '{node['name']}'. "
+            f"Available probes: {', '.join(READINESS_PROBES)}"
+        )
+
+
+def wait_ready(node, instances, prefix, timeout):
+    """Run the node group's readiness probe and report instances that never became ready."""
+    probe = READINESS_PROBES[node["ready"]["probe"]]
+    not_ready = probe(node, instances, prefix, timeout)
+    if not_ready:
+        error(
+            f"Readiness probe '{node['ready']['probe']}' timed out after {timeout}s "
+            f"for nodes: {', '.join(not_ready)}\n"
+        )
+    return not_ready
@@ -46,6 +46,22 @@ def update_performance_results(json_data, res, name, case, prom_flag):
         "reported_time": round(reported_time, 2),
         "elapsed": round(elapsed, 2),
     }
+    resources = json_data.get("resources", {})
+    if "cpu_seconds_per_gb" in resources:
+        res[name][case]["cpu_seconds_per_gb"] = round(resources["cpu_seconds_per_gb"], 4)
+    if "memory_peak" in resources.get("group", {}):
+        res[name][case]["memory_peak_mb"] = round(
+            resources["group"]["memory_peak"] / 1024**2, 2
+        )
+    wire = json_data.get("wire", {})
+    if "goodput_mbits" in wire:
+        res[name][case]["wire_goodput"] = round(
+            wire["goodput_mbits"] / (1000 if not prom_flag else 1), 2
+        )
+    if "overhead_ratio" in wire:
+        res[name][case]["overhead_ratio"] = round(wire["overhead_ratio"], 4)
+    if "emulator_ceiling" in json_data:
+        res[name][case]["ceiling_ratio"] = round(json_data["emulator_ceiling"]["ratio"], 4)
     return res
 
 
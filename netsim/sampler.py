@@ -0,0 +1,300 @@
+import abc
+import collections
+import json
+import os
+import threading
+import time
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+
+def read_stat(path):
+    """Return (name, utime + stime in ticks) from a /proc stat file."""
+    with open(path, "r") as f:
+        data = f.read()
+    # The name is in parentheses and may itself contain spaces
+    name = data[data.index("(") + 1 : data.rindex(")")]
+    fields = data[data.rindex(")") + 2 :].split()
+    return name, int(fields[11]) + int(fields[12])
+
+
+def read_rss_kb(pid):
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1])
+    return 0
+
+
+def descendants(pid):
+    """pid and every process below it, following /proc children lists."""
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for tid in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{tid}/children", "r") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            continue
+    return pids
+
+
+class PeriodicSampler(abc.ABC):
+    """Calls sample() every interval seconds on a background thread.
+
+    Subclasses append rows to self.rows; write() stores them as one JSON
+    object per line."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.rows = []
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.start = None
+
+    def begin(self):
+        self.start = time.monotonic()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        next_at = self.start
+        while not self.stopEvent.is_set():
+            self.sample(round(time.monotonic() - self.start, 3))
+            next_at += self.interval
+            self.stopEvent.wait(max(0.0, next_at - time.monotonic()))
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join()
+
+    @abc.abstractmethod
+    def sample(self, t):
+        "Take one sample, t seconds after begin()"
+
+    def write(self, path):
+        with open(path, "w") as f:
+            for row in self.rows:
+                f.write(json.dumps(row, separators=(",", ":")) + "\n")
+
+
+class ProcSampler(PeriodicSampler):
+    """Samples CPU, RSS and per-thread CPU of every node's processes.
+
+    Node processes are taken from the case's process boxes as they get
+    launched. A node's processes are the members of its cgroup when
+    per-node cgroups are in use, else the launched shell and everything
+    below it. Each row holds the node's CPU% (100 = one core), summed
+    RSS, thread count and busiest thread at time t."""
+
+    def __init__(self, interval, boxes, cgroups=None, runner_id=0):
+        super().__init__(interval)
+        self.boxes = boxes
+        self.cgroups = cgroups
+        self.runner_id = runner_id
+        self.last = None
+        self.ticks = {}
+        self.thread_ticks = {}
+        self.summary = {}
+
+    def pids(self, node_name, p):
+        if self.cgroups:
+            procs = os.path.join(self.cgroups.path(self.runner_id, node_name), "cgroup.procs")
+            try:
+                with open(procs, "r") as f:
+                    return [int(pid) for pid in f.read().split()]
+            except OSError:
+                return []
+        return descendants(p.pid)
+
+    def sample(self, t):
+        now = time.monotonic()
+        elapsed = now - self.last if self.last else None
+        self.last = now
+        for box in self.boxes:
+            for node_name, p, _ in list(box):
+                self.sample_node(t, elapsed, node_name, p)
+
+    def sample_node(self, t, elapsed, node_name, p):
+        ticks, rss, threads = {}, 0, {}
+        for pid in self.pids(node_name, p):
+            try:
+                # Process totals include threads that already exited
+                _, process_ticks = read_stat(f"/proc/{pid}/stat")
+                process_rss = read_rss_kb(pid)
+                process_threads = {
+                    int(tid): read_stat(f"/proc/{pid}/task/{tid}/stat")
+                    for tid in os.listdir(f"/proc/{pid}/task")
+                }
+            except (OSError, ValueError, IndexError):
+                # The process exited while we were reading it
+                continue
+            ticks[pid] = process_ticks
+            rss += process_rss
+            threads.update(process_threads)
+        if not threads:
+            return
+
+        # Per process, so a child exiting does not take the CPU time
+        # of the others since the last sample with it
+        previous = self.ticks.get(node_name)
+        self.ticks[node_name] = ticks
+        if elapsed is None or previous is None:
+            return
+        used = 0
+        for pid, process_ticks in ticks.items():
+            before = previous.get(pid, 0)
+            # Processes that started since, or a reused pid, count in full
+            used += process_ticks - before if process_ticks >= before else process_ticks
+        cpu = used / CLK_TCK / elapsed * 100
+
+        top = None
+        for tid, (name, thread_ticks) in threads.items():
+            before = self.thread_ticks.get(tid)
+            self.thread_ticks[tid] = thread_ticks
+            if before is None:
+                continue
+            thread_cpu = max(0, thread_ticks - before) / CLK_TCK / elapsed * 100
+            if top is None or thread_cpu > top[2]:
+                top = (tid, name, thread_cpu)
+
+        row = {
+            "t": t,
+            "node": node_name,
+            "cpu": round(cpu, 1),
+            "rss_kb": rss,
+            "threads": len(threads),
+        }
+        if top:
+            row["top_thread"] = [top[1], round(top[2], 1)]
+        self.rows.append(row)
+
+        summary = self.summary.setdefault(
+            node_name, {"samples": 0, "peak_rss_kb": 0, "max_cpu_percent": 0.0}
+        )
+        summary["samples"] += 1
+        summary["peak_rss_kb"] = max(summary["peak_rss_kb"], rss)
+        summary["max_cpu_percent"] = round(max(summary["max_cpu_percent"], cpu), 1)
+        busiest = summary.get("busiest_thread")
+        if top and (busiest is None or top[2] > busiest["cpu_percent"]):
+            summary["busiest_thread"] = {
+                "tid": top[0],
+                "name": top[1],
+                "cpu_percent": round(top[2], 1),
+                "t": t,
+            }
+
+
+# Columns of /proc/net/dev that are sampled, by position after "intf:"
+NET_DEV_COLUMNS = {
+    "rx_bytes": 0,
+    "rx_packets": 1,
+    "rx_drop": 3,
+    "tx_bytes": 8,
+    "tx_packets": 9,
+    "tx_drop": 11,
+}
+
+
+# Seconds the sustained rates of an interface are averaged over
+SUSTAINED_WINDOW = 1.0
+
+
+def read_net_dev(pid):
+    """Counters of every interface in the network namespace of pid."""
+    counters = {}
+    with open(f"/proc/{pid}/net/dev", "r") as f:
+        for line in f.readlines()[2:]:
+            name, values = line.split(":", 1)
+            values = values.split()
+            counters[name.strip()] = {
+                key: int(values[i]) for key, i in NET_DEV_COLUMNS.items()
+            }
+    return counters
+
+
+class IntfSampler(PeriodicSampler):
+    """Samples the kernel counters of host interfaces.
+
+    Reads /proc/<node pid>/net/dev, which lists the 64 bit counters of
+    all interfaces in that node's namespace with one read per node.
+    Each row holds an interface's cumulative counters at time t; the
+    summary holds what happened after the first sample, the number of
+    seconds with traffic, the peak rates between two samples and the
+    peak sustained rates, averaged over SUSTAINED_WINDOW seconds."""
+
+    def __init__(self, interval, interfaces):
+        """interfaces: list of (node name, node pid, interface name)"""
+        super().__init__(interval)
+        self.nodes = {}
+        for node_name, pid, intf in interfaces:
+            self.nodes.setdefault(pid, []).append((node_name, intf))
+        self.first = {}
+        self.previous = {}
+        # (t, counters) of each interface reaching back SUSTAINED_WINDOW
+        self.history = {}
+        self.summary = {}
+
+    def sample(self, t):
+        for pid, intfs in self.nodes.items():
+            try:
+                counters = read_net_dev(pid)
+            except OSError:
+                continue
+            for node_name, intf in intfs:
+                if intf in counters:
+                    self.sample_intf(t, node_name, intf, counters[intf])
+
+    def sample_intf(self, t, node_name, intf, counters):
+        self.rows.append(dict(counters, t=t, intf=intf))
+        if intf not in self.first:
+            self.first[intf] = counters
+            self.previous[intf] = (t, counters)
+            self.history[intf] = collections.deque([(t, counters)])
+            self.summary[intf] = {
+                "node": node_name,
+                "active_s": 0.0,
+                "peak_rx_mbits": 0.0,
+                "peak_tx_mbits": 0.0,
+                "sustained_window_s": SUSTAINED_WINDOW,
+                "sustained_rx_mbits": 0.0,
+                "sustained_tx_mbits": 0.0,
+            }
+            return
+        summary = self.summary[intf]
+        for key in NET_DEV_COLUMNS:
+            summary[key] = counters[key] - self.first[intf][key]
+
+        last_t, last = self.previous[intf]
+        self.previous[intf] = (t, counters)
+        elapsed = t - last_t
+        if elapsed <= 0:
+            return
+        rx = counters["rx_bytes"] - last["rx_bytes"]
+        tx = counters["tx_bytes"] - last["tx_bytes"]
+        if rx or tx:
+            summary["active_s"] = round(summary["active_s"] + elapsed, 3)
+        summary["peak_rx_mbits"] = round(
+            max(summary["peak_rx_mbits"], rx * 8 / elapsed / 1e6), 3
+        )
+        summary["peak_tx_mbits"] = round(
+            max(summary["peak_tx_mbits"], tx * 8 / elapsed / 1e6), 3
+        )
+
+        history = self.history[intf]
+        history.append((t, counters))
+        while len(history) > 2 and t - history[1][0] >= SUSTAINED_WINDOW:
+            history.popleft()
+        first_t, first = history[0]
+        if t - first_t < SUSTAINED_WINDOW:
+            return
+        for direction in ("rx", "tx"):
+            key = f"sustained_{direction}_mbits"
+            moved = counters[f"{direction}_bytes"] - first[f"{direction}_bytes"]
+            summary[key] = round(
+                max(summary[key], moved * 8 / (t - first_t) / 1e6), 3
+            )
@@ -0,0 +1,137 @@
+import json
+import threading
+
+from net.network import linkDirections
+
+# Durations of previous runs, by "<sim name>__<case name>"
+HISTORY_PATH = "case_durations.json"
+# Weight of the latest run in the duration estimate
+HISTORY_WEIGHT = 0.5
+
+# Cost model used until a case has a measured duration
+BASE_CASE_SECONDS = 10
+HOST_CPU = 0.25  # cores per host running a command
+CPU_PER_GBIT = 1.0  # cores per Gbit/s pushed through the emulated links
+UNSHAPED_MBITS = 1000  # assumed rate of a link without a bw limit
+
+
+def load_history(path=HISTORY_PATH):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_history(history, path=HISTORY_PATH):
+    with open(path, "w") as f:
+        json.dump(history, f, indent=4, sort_keys=True)
+
+
+def record_duration(history, key, seconds):
+    """Blend a measured case duration into its running estimate."""
+    previous = history.get(key)
+    if previous is None:
+        history[key] = round(seconds, 3)
+    else:
+        history[key] = round(
+            HISTORY_WEIGHT * seconds + (1 - HISTORY_WEIGHT) * previous, 3
+        )
+
+
+def case_cpu(case, cpu_budget):
+    """Estimate how many cores a case keeps busy, within [1, cpu_budget].
+
+    Every host running a command costs a little, and every group that
+    talks to another one is assumed to push its link rate (or
+    UNSHAPED_MBITS if unshaped) per instance."""
+    hosts = 0
+    mbits = 0.0
+    for node in case["nodes"]:
+        count = int(node["count"])
+        hosts += count
+        if node.get("connect", {}).get("strategy", "none") == "none":
+            continue
+        rate = UNSHAPED_MBITS
+        if "link" in node:
+            up, down = linkDirections(node["link"])
+            rates = [p["bw"] for p in (up, down) if "bw" in p]
+            if rates:
+                rate = min(max(rates), UNSHAPED_MBITS)
+        mbits += count * rate
+    cpu = hosts * HOST_CPU + mbits / 1000 * CPU_PER_GBIT
+    return min(max(cpu, 1.0), cpu_budget)
+
+
+def case_duration(case, history, key):
+    """Expected wall time of a case: its history, else its waits plus a base."""
+    if key in history:
+        return history[key]
+    return BASE_CASE_SECONDS + sum(float(node.get("wait", 0)) for node in case["nodes"])
+
+
+class CaseScheduler:
+    """Packs jobs onto runner slots without exceeding a CPU budget.
+
+    Jobs are started longest first. Whenever a slot frees up, the
+    longest pending job that fits in the remaining budget is started, so
+    short cases fill the gaps left by long ones. A job that fails stops
+    new jobs from being started; running ones are waited for and the
+    first error is raised."""
+
+    def __init__(self, slots, cpu_budget):
+        self.slots = max(1, slots)
+        self.cpu_budget = cpu_budget
+
+    def run(self, jobs, fn):
+        """jobs: list of dicts with "cpu" and "duration"; fn(job, runner_id)"""
+        pending = sorted(jobs, key=lambda job: job["duration"], reverse=True)
+        free = list(range(min(self.slots, len(pending))))
+        slots = len(free)
+        state = {"used": 0.0, "running": 0, "failure": None}
+        cond = threading.Condition()
+
+        def worker(job, runner_id):
+            try:
+                fn(job, runner_id)
+            except Exception as e:
+                with cond:
+                    if state["failure"] is None:
+                        state["failure"] = e
+            finally:
+                with cond:
+                    free.append(runner_id)
+                    state["used"] -= job["cpu"]
+                    state["running"] -= 1
+                    cond.notify_all()
+
+        threads = []
+        with cond:
+            while pending and state["failure"] is None:
+                job = None
+                if free:
+                    job = next(
+                        (
+                            j
+                            for j in pending
+                            if state["used"] + j["cpu"] <= self.cpu_budget
+                            or state["running"] == 0
+                        ),
+                        None,
+                    )
+                if job is None:
+                    cond.wait()
+                    continue
+                pending.remove(job)
+                runner_id = free.pop(0)
+                state["used"] += job["cpu"]
+                state["running"] += 1
+                thread = threading.Thread(target=worker, args=(job, runner_id))
+                thread.start()
+                threads.append(thread)
+            while len(free) < slots:
+                cond.wait()
+        for thread in threads:
+            thread.join()
+        if state["failure"] is not None:
+            raise state["failure"]
@@ -0,0 +1,140 @@
+"""Micro-benchmark of Sniffer packet classification.
+
+Feeds synthetic frames of a star topology through Sniffer.handle() and
+through the linear lookups it replaced, and prints packets per second
+of both. Writing is left out, it happens on the writer thread:
+
+    python3 -m sniffer.bench --hosts 20 --packets 100000
+"""
+
+import argparse
+import socket
+import struct
+import time
+from ipaddress import ip_address
+
+import dpkt
+
+from sniffer.sniff import SWITCH_TYPES, Sniffer
+
+
+def parse_ips(packet):
+    eth = struct.unpack("!6s6sH", packet[:14])
+    if socket.ntohs(eth[2]) == 8:
+        iph = struct.unpack("!BBHHHBBH4s4s", packet[14:34])
+        return socket.inet_ntoa(iph[8]), socket.inet_ntoa(iph[9])
+    return None, None
+
+
+class LinearSniffer(Sniffer):
+    "Per packet lookups as Sniffer did them before its lookup tables"
+
+    def pkt_src_dest_rewrite(self, pkt, sip, smisnode, dip, dmisnode):
+        if not sip in self.node_ips:
+            return pkt
+        if not dip in self.node_ips:
+            return pkt
+        epkt = dpkt.ethernet.Ethernet(pkt)
+        if sip != smisnode["ip"]:
+            epkt.data.src = ip_address(smisnode["ip"]).packed
+        if dip != dmisnode["ip"]:
+            epkt.data.dst = ip_address(dmisnode["ip"]).packed
+        return epkt
+
+    def handle(self, ts, interface, pkttype, packet, wirelen=None):
+        intf = self.intfExists(interface)
+        if not intf:
+            return
+        srcMAC = ":".join("%02x" % b for b in packet[6:12])
+        dstMAC = ":".join("%02x" % b for b in packet[0:6])
+        smi = self.intfExists(srcMAC, True)
+        dmi = self.intfExists(dstMAC, True)
+        if not dmi:
+            return
+        sip, dip = parse_ips(packet)
+        self.intfExists(intf["link"])
+        src = intf["node"]
+        if pkttype != socket.PACKET_OUTGOING:
+            src = intf["link"].split("-")[0]
+        src_node = self.nodeExists(src)
+        smisnode = self.nodeExists(smi["node"])
+        dmisnode = self.nodeExists(dmi["node"])
+        if src_node and not src_node["type"] in SWITCH_TYPES:
+            wpkt = self.pkt_src_dest_rewrite(packet, sip, smisnode, dip, dmisnode)
+            return (ts, interface, packet, wirelen, bytes(wpkt))
+
+
+def star_topology(hosts):
+    "Topology info of hosts h0..hN-1 on switch s1, as Sniffer.TopoInfo builds it"
+    nodes = [{"name": "s1", "type": "OVSSwitch", "dpid": "1"}]
+    interfaces = []
+    for i in range(hosts):
+        name, ip = f"h{i}", f"10.0.{i // 250}.{i % 250 + 1}"
+        mac = f"02:00:00:00:{i // 256:02x}:{i % 256:02x}"
+        nodes.append({"name": name, "type": "Host", "ip": ip})
+        interfaces.append(
+            {"node": name, "type": "Host", "interface": f"{name}-e0", "mac": mac,
+             "ip": ip, "link": f"s1-e{i}", "shaping": {}}
+        )
+        interfaces.append(
+            {"node": "s1", "type": "OVSSwitch", "interface": f"s1-e{i}",
+             "mac": f"02:01:00:00:{i // 256:02x}:{i % 256:02x}", "ip": None,
+             "link": f"{name}-e0", "shaping": {}}
+        )
+    return {"nodes": nodes, "interfaces": interfaces}
+
+
+def frames(topo, count):
+    """UDP frames between random host pairs as seen on the sender's switch
+    port; every fourth one carries another host's source address."""
+    hosts = [i for i in topo["interfaces"] if i["type"] == "Host"]
+    out = []
+    for n in range(count):
+        a, b = hosts[n % len(hosts)], hosts[(n * 7 + 1) % len(hosts)]
+        sip = hosts[(n + 3) % len(hosts)]["ip"] if n % 4 == 0 else a["ip"]
+        udp = dpkt.udp.UDP(sport=4433, dport=4433, data=b"x" * 1200)
+        ip = dpkt.ip.IP(src=ip_address(sip).packed, dst=ip_address(b["ip"]).packed,
+                        p=dpkt.ip.IP_PROTO_UDP, data=udp)
+        eth = dpkt.ethernet.Ethernet(
+            src=bytes.fromhex(a["mac"].replace(":", "")),
+            dst=bytes.fromhex(b["mac"].replace(":", "")),
+            type=dpkt.ethernet.ETH_TYPE_IP, data=ip,
+        )
+        out.append(("s1-e" + a["node"][1:], 0, bytes(eth)))
+    return out
+
+
+def make_sniffer(cls, topo):
+    sniffer = cls.__new__(cls)
+    sniffer.nodes = topo["nodes"]
+    sniffer.interfaces = topo["interfaces"]
+    sniffer.node_ips = {i["ip"] for i in topo["interfaces"]}
+    sniffer.buildTables()
+    return sniffer
+
+
+def bench(cls, topo, packets):
+    sniffer = make_sniffer(cls, topo)
+    start = time.perf_counter()
+    records = [
+        sniffer.handle(0, interface, pkttype, packet)
+        for interface, pkttype, packet in packets
+    ]
+    elapsed = time.perf_counter() - start
+    assert all(records)
+    return len(packets) / elapsed, records
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hosts", type=int, default=20)
+    parser.add_argument("--packets", type=int, default=100000)
+    args = parser.parse_args()
+
+    topo = star_topology(args.hosts)
+    packets = frames(topo, args.packets)
+    before, _ = bench(LinearSniffer, topo, packets)
+    after, _ = bench(Sniffer, topo, packets)
+    print(f"{args.hosts} hosts, {args.packets} packets")
+    print(f"linear lookups + dpkt rewrite: {before:12,.0f} packets/s")
+    print(f"lookup tables + byte rewrite:  {after:12,.0f} packets/s ({after / before:.1f}x)")
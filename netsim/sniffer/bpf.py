@@ -0,0 +1,166 @@
+"""Classic BPF capture filters built from the topology.
+
+The sniffer's socket sits in the root namespace, where it sees the
+switch side of every link. Only frames a host sent into the switch are
+written, so the filter keeps frames entering switch ports that lead to
+a host, optionally limited to some IP protocols and ports. The kernel
+drops everything else before it is copied to the socket, and the
+accept verdict is the snaplen frames are cut to.
+"""
+
+import ctypes
+import socket
+import struct
+
+SO_ATTACH_FILTER = 26
+SOCK_FILTER = struct.Struct("HBBI")
+# BPF_MAXINSNS
+MAX_INSNS = 4096
+# Accept verdict without a snaplen, larger than any frame
+FULL_SNAPLEN = 0x40000
+
+LD_W_ABS = 0x20
+LD_H_ABS = 0x28
+LD_B_ABS = 0x30
+LD_H_IND = 0x48
+LDX_B_MSH = 0xB1
+JA = 0x05
+JEQ = 0x15
+JSET = 0x45
+RET = 0x06
+
+# Ancillary data loads, relative to SKF_AD_OFF
+SKF_AD_OFF = -0x1000
+SKF_AD_PKTTYPE = (SKF_AD_OFF + 4) & 0xFFFFFFFF
+SKF_AD_IFINDEX = (SKF_AD_OFF + 8) & 0xFFFFFFFF
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+PROTOCOLS = {"icmp": 1, "tcp": 6, "udp": 17, "icmpv6": 58, "sctp": 132}
+# Protocols whose first four bytes are the source and destination port
+PORT_PROTOCOLS = (6, 17, 132)
+
+
+def protocolNumber(proto):
+    if isinstance(proto, int):
+        return proto
+    if proto.lower() not in PROTOCOLS:
+        raise ValueError(
+            f"Unknown capture protocol {proto!r}, expected one of "
+            f"{', '.join(PROTOCOLS)} or a protocol number"
+        )
+    return PROTOCOLS[proto.lower()]
+
+
+class Program(object):
+    "Instructions with symbolic jump targets, resolved by assemble()"
+
+    def __init__(self):
+        self.insns = []
+        self.labels = {}
+
+    def label(self, name):
+        self.labels[name] = len(self.insns)
+
+    def add(self, code, k=0, jt=0, jf=0):
+        self.insns.append((code, jt, jf, k))
+
+    def assemble(self):
+        if len(self.insns) > MAX_INSNS:
+            raise ValueError(f"BPF program of {len(self.insns)} instructions is too long")
+        out = []
+        for i, (code, jt, jf, k) in enumerate(self.insns):
+            if code == JA:
+                k = self.labels[k] - i - 1 if isinstance(k, str) else k
+            else:
+                jt = self.labels[jt] - i - 1 if isinstance(jt, str) else jt
+                jf = self.labels[jf] - i - 1 if isinstance(jf, str) else jf
+                if not (0 <= jt <= 255 and 0 <= jf <= 255):
+                    raise ValueError(f"BPF jump out of range at instruction {i}")
+            out.append((code, jt, jf, k))
+        return out
+
+
+def protoChecks(prog, protos, ports, l4):
+    """Accept the protocol in A if allowed; check ports of port protocols
+    at the transport header offset l4 (None: X holds the IPv4 header length)."""
+    portProtos = [p for p in protos if p in PORT_PROTOCOLS] if ports else []
+    for proto in protos:
+        if proto in portProtos:
+            prog.add(JEQ, proto, "ports" + str(l4), 0)
+        else:
+            prog.add(JEQ, proto, "accept", 0)
+    prog.add(JA, "drop")
+    if not portProtos:
+        return
+    prog.label("ports" + str(l4))
+    if l4 is None:
+        # Fragments past the first carry no transport header
+        prog.add(LD_H_ABS, 20)
+        prog.add(JSET, 0x1FFF, "drop", 0)
+        prog.add(LDX_B_MSH, 14)
+    for offset in (0, 2):
+        if l4 is None:
+            prog.add(LD_H_IND, 14 + offset)
+        else:
+            prog.add(LD_H_ABS, l4 + offset)
+        for port in ports:
+            prog.add(JEQ, port, "accept", 0)
+    prog.add(JA, "drop")
+
+
+def captureFilter(ifindexes, protocols=None, ports=None, snaplen=0):
+    """Assemble the filter for frames entering the given root namespace
+    interfaces.
+
+    protocols: IP protocol names or numbers to keep, default all
+    ports: TCP/UDP/SCTP ports to keep; packets of other allowed protocols
+    are not port filtered. Ports alone imply tcp and udp.
+    snaplen: bytes kept of each frame, 0 for all"""
+    if not isinstance(snaplen, int) or isinstance(snaplen, bool) or not (
+        0 <= snaplen <= FULL_SNAPLEN
+    ):
+        raise ValueError(
+            "Capture snaplen %r must be an integer in 0..%d" % (snaplen, FULL_SNAPLEN)
+        )
+    protos = [protocolNumber(p) for p in protocols or []]
+    ports = [int(p) for p in ports or []]
+    if ports and not protos:
+        protos = [6, 17]
+
+    prog = Program()
+    prog.add(LD_W_ABS, SKF_AD_PKTTYPE)
+    prog.add(JEQ, socket.PACKET_OUTGOING, "drop", 0)
+    prog.add(LD_W_ABS, SKF_AD_IFINDEX)
+    # Every compare hops over an unconditional jump, so the chain can be
+    # longer than a conditional jump reaches
+    for ifindex in sorted(set(ifindexes)):
+        prog.add(JEQ, ifindex, 0, 1)
+        prog.add(JA, "intf")
+    prog.add(JA, "drop")
+
+    prog.label("intf")
+    if protos:
+        prog.add(LD_H_ABS, 12)
+        prog.add(JEQ, ETH_P_IP, 0, 2)
+        prog.add(LD_B_ABS, 23)
+        prog.add(JA, "ipv4")
+        prog.add(JEQ, ETH_P_IPV6, 0, "drop")
+        prog.add(LD_B_ABS, 20)
+        protoChecks(prog, protos, ports, 54)
+        prog.label("ipv4")
+        protoChecks(prog, protos, ports, None)
+    prog.label("accept")
+    prog.add(RET, snaplen or FULL_SNAPLEN)
+    prog.label("drop")
+    prog.add(RET, 0)
+    return prog.assemble()
+
+
+def attachFilter(sock, insns):
+    "Attach assembled instructions to a socket with SO_ATTACH_FILTER"
+    code = b"".join(SOCK_FILTER.pack(*insn) for insn in insns)
+    buf = ctypes.create_string_buffer(code, len(code))
+    # struct sock_fprog: instruction count and a pointer to them
+    fprog = struct.pack("HP", len(insns), ctypes.addressof(buf))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
@@ -0,0 +1,89 @@
+import struct
+
+PCAP_MAGIC = 0xA1B2C3D4
+DLT_EN10MB = 1
+FILE_HDR = struct.Struct("=IHHiIII")
+RECORD_HDR = struct.Struct("=IIII")
+
+PCAPNG_BYTE_ORDER = 0x1A2B3C4D
+SHB_TYPE = 0x0A0D0D0A
+IDB_TYPE = 0x00000001
+EPB_TYPE = 0x00000006
+OPT_ENDOFOPT = 0
+IF_NAME = 2
+IF_TSRESOL = 9
+# if_tsresol of 10^-9: timestamps in nanoseconds
+TSRESOL_NS = 9
+
+# Suffix of the files each format is written to
+FORMATS = {"pcap": ".pcap", "pcapng": ".pcapng"}
+
+
+def pad4(data):
+    return data + b"\x00" * (-len(data) % 4)
+
+
+class PcapWriter(object):
+    """Microsecond pcap writer that keeps the wire length of frames cut to
+    a snaplen, so readers still see how large each packet was.
+
+    Timestamps are integer nanoseconds; record() returns the bytes of a
+    packet so callers can batch them into one write."""
+
+    def __init__(self, fileobj, snaplen=65535, linktype=DLT_EN10MB):
+        self.f = fileobj
+        self.f.write(FILE_HDR.pack(PCAP_MAGIC, 2, 4, 0, 0, snaplen, linktype))
+
+    def record(self, pkt, ts, wirelen=None, interface=None):
+        pkt = bytes(pkt)
+        sec, nsec = divmod(ts, 1000000000)
+        return RECORD_HDR.pack(sec, nsec // 1000, len(pkt), wirelen or len(pkt)) + pkt
+
+    def writepkt(self, pkt, ts, wirelen=None, interface=None):
+        self.f.write(self.record(pkt, ts, wirelen, interface))
+
+
+class PcapngWriter(object):
+    """pcapng writer with one interface description per capturing
+    interface, named after it, and nanosecond timestamps."""
+
+    def __init__(self, fileobj, snaplen=65535, linktype=DLT_EN10MB):
+        self.f = fileobj
+        self.snaplen = snaplen
+        self.linktype = linktype
+        self.interfaces = {}
+        # Section header of unknown length, without options
+        self.f.write(struct.pack("=IIIHHqI", SHB_TYPE, 28, PCAPNG_BYTE_ORDER, 1, 0, -1, 28))
+
+    def block(self, blockType, body):
+        length = 12 + len(body)
+        return struct.pack("=II", blockType, length) + body + struct.pack("=I", length)
+
+    def describe(self, interface):
+        "Interface description block for a newly seen interface"
+        name = (interface or "").encode()
+        options = struct.pack("=HH", IF_NAME, len(name)) + pad4(name)
+        options += struct.pack("=HHB", IF_TSRESOL, 1, TSRESOL_NS) + b"\x00" * 3
+        options += struct.pack("=HH", OPT_ENDOFOPT, 0)
+        self.interfaces[interface] = len(self.interfaces)
+        return self.block(
+            IDB_TYPE, struct.pack("=HHI", self.linktype, 0, self.snaplen) + options
+        )
+
+    def record(self, pkt, ts, wirelen=None, interface=None):
+        pkt = bytes(pkt)
+        out = b""
+        if interface not in self.interfaces:
+            out = self.describe(interface)
+        body = struct.pack(
+            "=IIIII",
+            self.interfaces[interface],
+            ts >> 32,
+            ts & 0xFFFFFFFF,
+            len(pkt),
+            wirelen or len(pkt),
+        )
+        return out + self.block(EPB_TYPE, body + pad4(pkt))
+
+    def writepkt(self, pkt, ts, wirelen=None, interface=None):
+        self.f.write(self.record(pkt, ts, wirelen, interface))
@@ -0,0 +1,184 @@
+"""AF_PACKET capture through a TPACKET_V3 memory-mapped block ring.
+
+The kernel fills whole blocks of frames in a ring shared with us and
+hands a block over once it is full or its timeout expires, so one
+poll() wakes us for a batch of packets that are read straight from the
+ring instead of one recvfrom() syscall per packet.
+"""
+
+import mmap
+import select
+import socket
+import struct
+
+from sniffer.bpf import attachFilter
+
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_AUXDATA = 8
+PACKET_VERSION = 10
+PACKET_FANOUT = 18
+TPACKET_V3 = 2
+PACKET_FANOUT_HASH = 0
+# Let the kernel pick a group id no other socket on the host uses (4.4+)
+PACKET_FANOUT_FLAG_UNIQUEID = 0x2000
+PACKET_FANOUT_FLAG_DEFRAG = 0x8000
+ETH_P_ALL = 0x0003
+
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+
+# struct tpacket_req3
+TPACKET_REQ3 = struct.Struct("IIIIIII")
+# struct tpacket_block_desc: version, offset_to_priv, then tpacket_hdr_v1
+# block_status, num_pkts, offset_to_first_pkt
+BLOCK_HDR = struct.Struct("III")
+BLOCK_HDR_OFFSET = 8
+# struct tpacket3_hdr: tp_next_offset, tp_sec, tp_nsec, tp_snaplen,
+# tp_len, tp_status, tp_mac, tp_net
+PACKET_HDR = struct.Struct("IIIIIIHH")
+# struct sockaddr_ll follows the header at TPACKET_ALIGN(sizeof(tpacket3_hdr))
+SOCKADDR_LL_OFFSET = 48
+SOCKADDR_LL = struct.Struct("HHiHBB")
+# struct tpacket_stats_v3: tp_packets, tp_drops, tp_freeze_q_cnt
+STATS_V3 = struct.Struct("III")
+# struct tpacket_auxdata: tp_status, tp_len, tp_snaplen, tp_mac, tp_net,
+# tp_vlan_tci, tp_vlan_tpid
+AUXDATA = struct.Struct("IIIHHHH")
+
+# 32 MiB of locked memory per socket; --capture-ring-mb changes the count
+DEFAULT_BLOCK_SIZE = 1 << 20
+DEFAULT_BLOCK_COUNT = 32
+DEFAULT_FRAME_SIZE = 1 << 11
+# ms before the kernel hands over a block that is not full yet
+DEFAULT_BLOCK_TIMEOUT = 50
+# fanout argument that creates a new group instead of joining one
+NEW_FANOUT_GROUP = -1
+
+
+class PacketRing(object):
+    """One AF_PACKET socket on all interfaces with a TPACKET_V3 RX ring.
+
+    fanout: optional group id; sockets in the same group share the
+    traffic, split by flow hash, so each can be drained by its own
+    thread. NEW_FANOUT_GROUP creates a group with an id the kernel
+    picks, so concurrent captures never share one; the id is then in
+    self.fanout for the other sockets to join.
+    bpf: optional assembled filter, see sniffer.bpf."""
+
+    def __init__(
+        self,
+        block_size=DEFAULT_BLOCK_SIZE,
+        block_count=DEFAULT_BLOCK_COUNT,
+        frame_size=DEFAULT_FRAME_SIZE,
+        block_timeout=DEFAULT_BLOCK_TIMEOUT,
+        fanout=None,
+        bpf=None,
+    ):
+        self.sock = socket.socket(
+            socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL)
+        )
+        try:
+            # Before the ring exists, so unfiltered frames never reach it
+            if bpf:
+                attachFilter(self.sock, bpf)
+            self.sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            req = TPACKET_REQ3.pack(
+                block_size,
+                block_count,
+                frame_size,
+                block_size // frame_size * block_count,
+                block_timeout,
+                0,
+                0,
+            )
+            self.sock.setsockopt(SOL_PACKET, PACKET_RX_RING, req)
+            self.ring = mmap.mmap(
+                self.sock.fileno(),
+                block_size * block_count,
+                mmap.MAP_SHARED,
+                mmap.PROT_READ | mmap.PROT_WRITE,
+            )
+            if fanout is not None:
+                flags = PACKET_FANOUT_HASH | PACKET_FANOUT_FLAG_DEFRAG
+                if fanout == NEW_FANOUT_GROUP:
+                    # The kernel requires id 0 with this flag
+                    fanout, flags = 0, flags | PACKET_FANOUT_FLAG_UNIQUEID
+                self.sock.setsockopt(
+                    SOL_PACKET, PACKET_FANOUT, struct.pack("I", fanout | flags << 16)
+                )
+                # Reads back as id | type << 16 | flags << 24
+                data = self.sock.getsockopt(SOL_PACKET, PACKET_FANOUT, 4)
+                fanout = struct.unpack("I", data)[0] & 0xFFFF
+        except OSError:
+            self.sock.close()
+            raise
+        self.fanout = fanout
+        self.view = memoryview(self.ring)
+        self.blockSize = block_size
+        self.blockCount = block_count
+        self.block = 0
+        self.poller = select.poll()
+        self.poller.register(self.sock, select.POLLIN | select.POLLERR)
+        self.ifnames = {}
+        self.packets = 0
+        self.drops = 0
+        self.freezes = 0
+
+    def ifname(self, ifindex):
+        name = self.ifnames.get(ifindex)
+        if name is None:
+            try:
+                name = socket.if_indextoname(ifindex)
+            except OSError:
+                name = ""
+            self.ifnames[ifindex] = name
+        return name
+
+    def batches(self, timeout_ms, stop):
+        """Yield the packets of each block the kernel hands over as a list
+        of (timestamp ns, interface, pkttype, frame, wire length) until stop()
+        is true. Frames are cut to the filter's snaplen."""
+        while not stop():
+            offset = self.block * self.blockSize
+            status, count, first = BLOCK_HDR.unpack_from(
+                self.ring, offset + BLOCK_HDR_OFFSET
+            )
+            if not status & TP_STATUS_USER:
+                self.poller.poll(timeout_ms)
+                continue
+            batch = []
+            pkt = offset + first
+            for _ in range(count):
+                nxt, sec, nsec, snaplen, wirelen, _, mac, _ = PACKET_HDR.unpack_from(
+                    self.ring, pkt
+                )
+                _, _, ifindex, _, pkttype, _ = SOCKADDR_LL.unpack_from(
+                    self.ring, pkt + SOCKADDR_LL_OFFSET
+                )
+                frame = self.view[pkt + mac : pkt + mac + snaplen].tobytes()
+                ts = sec * 1000000000 + nsec
+                batch.append((ts, self.ifname(ifindex), pkttype, frame, wirelen))
+                pkt += nxt
+            # Hand the block back to the kernel
+            struct.pack_into("I", self.ring, offset + BLOCK_HDR_OFFSET, TP_STATUS_KERNEL)
+            self.block = (self.block + 1) % self.blockCount
+            yield batch
+
+    def collectStats(self):
+        "Add the counters the kernel kept since the last call (reading resets them)"
+        data = self.sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, STATS_V3.size)
+        packets, drops, freezes = STATS_V3.unpack(data)
+        self.packets += packets
+        self.drops += drops
+        self.freezes += freezes
+
+    def close(self):
+        try:
+            self.collectStats()
+        except OSError:
+            pass
+        self.view.release()
+        self.ring.close()
+        self.sock.close()
@@ -1,10 +1,25 @@
+import json
 import socket
 import sys
 import threading
-import dpkt
-from struct import unpack
+import time
+from collections import namedtuple
 from ipaddress import ip_address
 
+from mininet.log import error
+
+from sniffer.bpf import FULL_SNAPLEN, attachFilter, captureFilter
+from sniffer.ring import (
+    AUXDATA,
+    DEFAULT_BLOCK_COUNT,
+    NEW_FANOUT_GROUP,
+    PACKET_AUXDATA,
+    SOL_PACKET,
+    PacketRing,
+)
+from sniffer.windows import CaptureGate
+from sniffer.writer import CaptureWriter, RotatingWriter
+
 HOST_TYPES = ["Host", "CPULimitedHost", "NAT", "EdgeNode", "LinuxRouter"]
 SWITCH_TYPES = [
     "UserSwitch",
@@ -14,7 +29,11 @@ SWITCH_TYPES = [
     "IVSSwitch",
     "LinuxBridge",
     "OVSSwitch",
+    "NetnsBridge",
 ]
+# TCIntf parameters that are reported per interface in the topology
+SHAPING_PARAMS = ["bw", "delay", "jitter", "loss", "max_queue_size", "high_rate", "leaf"]
+
 CONTROLLER_TYPES = [
     "Controller",
     "OVSController",
@@ -24,26 +43,42 @@ CONTROLLER_TYPES = [
     "DefaultController",
     "NullController",
 ]
+# Checksum offset in the transport header of TCP and UDP
+L4_CSUM_OFFSETS = {6: 16, 17: 6}
+
+# What handle() needs to know about a node, with its IP address packed
+NodeRecord = namedtuple("NodeRecord", ["node", "type", "ip", "is_switch"])
+
+# ms a capture thread waits for a ring block before checking for close()
+RING_POLL_TIMEOUT = 200
 
 
-def parse_ips(packet):
-    eth_length = 14
-    eth_header = packet[:eth_length]
-    eth = unpack("!6s6sH", eth_header)
-    eth_protocol = socket.ntohs(eth[2])
-    if eth_protocol == 8:
-        ip_header = packet[eth_length : 20 + eth_length]
-        iph = unpack("!BBHHHBBH4s4s", ip_header)
-        s_addr = socket.inet_ntoa(iph[8])
-        d_addr = socket.inet_ntoa(iph[9])
-        return s_addr, d_addr
-    return None, None
+def csumAdjust(csum, old, new):
+    "RFC 1624 update of a ones' complement checksum for replaced bytes"
+    total = ~int.from_bytes(csum, "big") & 0xFFFF
+    for i in range(0, len(old), 2):
+        total += (~int.from_bytes(old[i : i + 2], "big") & 0xFFFF) + int.from_bytes(
+            new[i : i + 2], "big"
+        )
+    while total >> 16:
+        total = (total & 0xFFFF) + (total >> 16)
+    return (~total & 0xFFFF).to_bytes(2, "big")
 
 
 class Sniffer:
 
-    def __init__(self, net, output="netsim.pcap"):
+    def __init__(self, net, output="netsim.pcap", fanout=1, capture=None):
+        """fanout: number of ring sockets and threads sharing the capture
+        capture: optional "protocols", "ports" and "snaplen" of the kernel
+        capture filter, and the output "format" (pcap or pcapng) and
+        rotation: "rotate_mb", "rotate_s" and the number of "files" kept,
+        "windows" that limit what is written, see sniffer.windows, and
+        "ring_mb", the size of each packet ring in MiB"""
         self.output = output
+        self.fanout = max(1, fanout)
+        self.capture = capture or {}
+        self.snaplen = int(self.capture.get("snaplen", 0))
+        self.bpf = None
 
         self.net = net
         self.nodes = []
@@ -51,17 +86,69 @@ class Sniffer:
         self.interfaces = []
 
         self.snifferd = None
+        self.threads = []
+        self.rings = []
+        self.engine = None
+        self.writer = None
+        self.lock = threading.Lock()
+        self.gate = None
+        self.windows = []
 
         self.TopoInfo()
+        self.buildTables()
 
     def start(self):
-        self.output_f = open(self.output, "wb")
-        self.output_f_viz = open(self.output.replace(".pcap", ".viz.pcap"), "wb")
+        fmt = self.capture.get("format", "pcap")
+        snaplen = min(self.snaplen or FULL_SNAPLEN, 65535)
+        pcap = RotatingWriter(
+            self.output,
+            fmt,
+            snaplen,
+            int(float(self.capture.get("rotate_mb", 0)) * 1e6),
+            float(self.capture.get("rotate_s", 0)),
+            int(self.capture.get("files", 0)),
+        )
+        # The viz copy is drawn as a whole, so it never rotates
+        viz = RotatingWriter(self.output.replace(".pcap", ".viz.pcap"), fmt, snaplen)
+        self.writer = CaptureWriter(pcap, viz)
+        windows = self.capture.get("windows")
+        if windows:
+            before = max(float(window.get("before", 0)) for window in windows)
+            self.gate = CaptureGate(int(before * 1e9))
         self.kill = False
+        try:
+            self.bpf = captureFilter(
+                self.captureIfindexes(),
+                self.capture.get("protocols"),
+                self.capture.get("ports"),
+                self.snaplen,
+            )
+        except ValueError as e:
+            error(f"Capturing without a kernel filter: {e}\n")
+        try:
+            group = NEW_FANOUT_GROUP if self.fanout > 1 else None
+            blocks = int(self.capture.get("ring_mb", DEFAULT_BLOCK_COUNT))
+            for _ in range(self.fanout):
+                ring = PacketRing(block_count=blocks, fanout=group, bpf=self.bpf)
+                self.rings.append(ring)
+                group = ring.fanout
+            self.engine = "ring"
+        except OSError as e:
+            error(f"Packet ring unavailable, capturing with recvfrom: {e}\n")
+            for ring in self.rings:
+                ring.close()
+            self.rings = []
+            self.engine = "socket"
         # Start siniffing packets on Mininet interfaces
-        self.snifferd = threading.Thread(target=self.sniff)
-        self.snifferd.daemon = True
-        self.snifferd.start()
+        if self.rings:
+            for ring in self.rings:
+                self.threads.append(threading.Thread(target=self.sniffRing, args=(ring,)))
+        else:
+            self.threads.append(threading.Thread(target=self.sniff))
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+        self.snifferd = self.threads[0]
 
     def get_topoinfo(self):
         return {"nodes": self.nodes, "interfaces": self.interfaces}
@@ -81,6 +168,7 @@ class Sniffer:
             for intf in value.intfList():
                 t_intf = str(intf.link).replace(intf.name, "").replace("<->", "")
                 if t_intf != "None":
+                    params = getattr(intf, "params", {})
                     self.interfaces.append(
                         {
                             "node": node["name"],
@@ -89,10 +177,32 @@ class Sniffer:
                             "mac": intf.mac,
                             "ip": intf.ip,
                             "link": t_intf,
+                            # Shaping applies to traffic leaving this interface
+                            "shaping": {
+                                k: params[k] for k in SHAPING_PARAMS if k in params
+                            },
                         }
                     )
                     self.node_ips.add(intf.ip)
 
+    def captureIfindexes(self):
+        """Root namespace ifindexes of the switch ports leading to a host,
+        which see every frame a host sends"""
+        ifindexes = []
+        for intf in self.interfaces:
+            peer = self.nodeExists(intf["link"].split("-")[0])
+            if intf["type"] not in SWITCH_TYPES or not peer:
+                continue
+            if peer["type"] not in HOST_TYPES:
+                continue
+            try:
+                ifindexes.append(socket.if_nametoindex(intf["interface"]))
+            except OSError:
+                continue
+        if not ifindexes:
+            raise ValueError("no switch port to a host in the root namespace")
+        return ifindexes
+
     def intfExists(self, interface, by_mac=False):
         for intf in self.interfaces:
             if by_mac:
@@ -108,93 +218,202 @@ class Sniffer:
                 return n
         return None
 
-    def pkt_src_dest_rewrite(self, pkt, sip, smisnode, dip, dmisnode):
-        # if smi ip != sip then rewrite sip
-        # if dmi ip != dip then rewrite dip
-        # if src ip or dst ip not known then ignore
-        if not sip in self.node_ips:
-            return pkt
-        if not dip in self.node_ips:
-            return pkt
-        epkt = dpkt.ethernet.Ethernet(pkt)
-        if sip != smisnode["ip"]:
-            ip = epkt.data
-            tip = ip_address(smisnode["ip"]).packed
-            ip.src = tip
-        if dip != dmisnode["ip"]:
-            ip = epkt.data
-            tip = ip_address(dmisnode["ip"]).packed
-            ip.dst = tip
-        return epkt
+    def buildTables(self):
+        """Index the topology for handle(): capturing interfaces by name to
+        their own and their peer's node, and nodes by raw MAC"""
+        records = {}
+        for node in self.nodes:
+            ip = node.get("ip") if node["type"] in HOST_TYPES else None
+            records[node["name"]] = NodeRecord(
+                node["name"],
+                node["type"],
+                ip_address(ip).packed if ip else None,
+                node["type"] in SWITCH_TYPES,
+            )
+        self.byName = {}
+        self.byMac = {}
+        for intf in self.interfaces:
+            own = records.get(intf["node"])
+            self.byName[intf["interface"]] = (
+                own,
+                records.get(intf["link"].split("-")[0]),
+            )
+            if intf["mac"]:
+                self.byMac.setdefault(bytes.fromhex(intf["mac"].replace(":", "")), own)
+        self.nodeIps = {ip_address(ip).packed for ip in self.node_ips if ip}
+        self.vizBuf = bytearray(FULL_SNAPLEN)
+        self.vizView = memoryview(self.vizBuf)
+
+    def rewrite(self, packet, smi, dmi):
+        """IPv4 frame with the addresses of its sending and receiving nodes
+        when it carries other known node addresses, else the frame itself.
+        The rewritten frame lives in a buffer reused by the next call."""
+        if packet[12:14] != b"\x08\x00" or len(packet) < 34:
+            return packet
+        old = packet[26:34]
+        sip, dip = old[:4], old[4:]
+        if sip not in self.nodeIps or dip not in self.nodeIps:
+            return packet
+        new = (smi.ip or sip) + (dmi.ip or dip)
+        if new == old:
+            return packet
+        n = len(packet)
+        buf = self.vizBuf
+        buf[:n] = packet
+        buf[26:34] = new
+        buf[24:26] = csumAdjust(packet[24:26], old, new)
+        # Transport checksums cover the addresses through the pseudo header,
+        # and only the first fragment has one
+        l4 = 14 + (packet[14] & 0x0F) * 4
+        offset = None
+        if not int.from_bytes(packet[20:22], "big") & 0x1FFF:
+            offset = L4_CSUM_OFFSETS.get(packet[23])
+        if offset is not None and l4 + offset + 2 <= n:
+            at = l4 + offset
+            # A zero UDP checksum means there is none
+            if packet[23] != 17 or packet[at : at + 2] != b"\x00\x00":
+                buf[at : at + 2] = csumAdjust(packet[at : at + 2], old, new)
+                if packet[23] == 17 and buf[at : at + 2] == b"\x00\x00":
+                    buf[at : at + 2] = b"\xff\xff"
+        return self.vizView[:n]
+
+    def handle(self, ts, interface, pkttype, packet, wirelen=None):
+        """Record to write for a captured frame, None if it is not written:
+        (timestamp ns, interface, frame, wire length, viz frame)"""
+        ends = self.byName.get(interface)
+        if ends is None:
+            return
+        smi = self.byMac.get(packet[6:12])
+        if smi is None:
+            print("smi not found", packet[6:12].hex(":"))
+            return
+        dmi = self.byMac.get(packet[0:6])
+        if dmi is None:
+            return
+
+        # Frames leaving an interface were sent by its node, the others by
+        # the node at the other end of the link
+        src = ends[0] if pkttype == socket.PACKET_OUTGOING else ends[1]
+        if src is None or src.is_switch:
+            return
+
+        viz = self.rewrite(packet, smi, dmi)
+        # The rewrite buffer is reused for the next frame
+        viz = packet if viz is packet else bytes(viz)
+        return (ts, interface, packet, wirelen, viz)
+
+    def sniffRing(self, ring):
+        # One lock round trip and one queued write per ring block
+        for batch in ring.batches(RING_POLL_TIMEOUT, lambda: self.kill):
+            records = []
+            with self.lock:
+                for ts, interface, pkttype, packet, wirelen in batch:
+                    try:
+                        record = self.handle(ts, interface, pkttype, packet, wirelen)
+                    except Exception:
+                        continue
+                    if record:
+                        records.append(record)
+            self.persist(records)
+            ring.collectStats()
 
     def sniff(self):
+        "Fallback capture with one recvfrom() per packet"
         print("Starting sniffer")
         try:
             s = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.ntohs(0x0003))
         except socket.error as msg:
             print("Error creating socket:" + str(msg[0]) + " | " + msg[1])
             sys.exit()
-        pcapw = dpkt.pcap.Writer(self.output_f)
-        pcapw_viz = dpkt.pcap.Writer(self.output_f_viz)
+        if self.bpf:
+            attachFilter(s, self.bpf)
+        # The original length of frames the filter cut to its snaplen
+        # comes as ancillary data; MSG_TRUNC would only give the cut one
+        s.setsockopt(SOL_PACKET, PACKET_AUXDATA, 1)
+        s.settimeout(RING_POLL_TIMEOUT / 1000)
         while True:
             if self.kill:
                 break
-            packet = s.recvfrom(65565)
-
             try:
-                interface = packet[1][0]
-                intf = self.intfExists(interface)
-                if not intf:
-                    continue
-            except Exception as e:
+                packet, ancdata, _, addr = s.recvmsg(
+                    65565, socket.CMSG_SPACE(AUXDATA.size)
+                )
+            except socket.timeout:
                 continue
-
-            direction = "incoming"
-            if packet[1][2] == socket.PACKET_OUTGOING:
-                direction = "outgoing"
-
-            packet = packet[0]
-
-            dstMAC = ":".join("%02x" % b for b in packet[0:6])
-            srcMAC = ":".join("%02x" % b for b in packet[6:12])
-
-            srcMAC = str(srcMAC)
-            dstMAC = str(dstMAC)
-
-            smi = self.intfExists(srcMAC, True)
-            dmi = self.intfExists(dstMAC, True)
-
-            if not smi:
-                print("smi not found", srcMAC)
-
-            if not dmi:
-                # print("dmi not found", dstMAC)
+            wirelen = None
+            for level, kind, data in ancdata:
+                if level == SOL_PACKET and kind == PACKET_AUXDATA:
+                    wirelen = AUXDATA.unpack_from(data)[1]
+            try:
+                record = self.handle(time.time_ns(), addr[0], addr[2], packet, wirelen)
+            except Exception as e:
                 continue
+            if record:
+                self.persist([record])
+        s.close()
 
-            sip, dip = parse_ips(packet)
-
-            link = self.intfExists(intf["link"])
-            src, dst = intf["node"], intf["link"].split("-")[0]
-            if direction == "incoming":
-                src, dst = intf["link"].split("-")[0], intf["node"]
+    def persist(self, records):
+        if self.gate:
+            records = self.gate.admit(records)
+        self.writer.put(records)
 
-            src_node = self.nodeExists(src)
+    def trigger(self, reason, before=0.0, after=None):
+        """Open a capture window from `before` seconds ago to `after`
+        seconds from now, or to the end of the capture without `after`."""
+        if not self.gate or not self.writer:
+            return
+        now = time.time_ns()
+        start = now - int(before * 1e9)
+        end = None if after is None else now + int(after * 1e9)
+        records, truncated = self.gate.open(start, end)
+        # Called from the case's timer and log threads, which must not
+        # wait for the writer; the records are in memory already
+        self.writer.put(records, wait=False)
+        window = {
+            "reason": reason,
+            "start": start / 1e9,
+            "end": None if end is None else end / 1e9,
+        }
+        if truncated:
+            window["pretrigger_evicted"] = True
+        self.windows.append(window)
 
-            smisnode = self.nodeExists(smi["node"])
-            dmisnode = self.nodeExists(dmi["node"])
-
-            if src_node:
-                if not src_node["type"] in SWITCH_TYPES:
-                    pcapw.writepkt(packet)
-                    wpkt = self.pkt_src_dest_rewrite(
-                        packet, sip, smisnode, dip, dmisnode
-                    )
-                    pcapw_viz.writepkt(wpkt)
+    def captureStats(self):
+        stats = {
+            "engine": self.engine,
+            "written": self.writer.written,
+            "kernel_filter": self.bpf is not None,
+            "snaplen": self.snaplen,
+            "files": self.writer.pcap.paths,
+            "viz_files": self.writer.viz.paths,
+        }
+        if self.gate:
+            stats["windows"] = self.windows
+            stats["pretrigger"] = {
+                "max_bytes": self.gate.maxBytes,
+                "evicted": self.gate.evicted,
+            }
+        if self.writer.failed:
+            stats["write_error"] = self.writer.failed
+        if self.rings:
+            stats["sockets"] = len(self.rings)
+            stats["ring_bytes"] = sum(r.blockSize * r.blockCount for r in self.rings)
+            stats["packets"] = sum(ring.packets for ring in self.rings)
+            stats["drops"] = sum(ring.drops for ring in self.rings)
+            stats["freeze_q_cnt"] = sum(ring.freezes for ring in self.rings)
+        return stats
 
     def close(self):
-        if self.snifferd:
-            self.kill = True
-        try:
-            self.output_f.close()
-        except Exception:
-            pass
+        if not self.snifferd:
+            return
+        self.kill = True
+        # Capture threads check for kill at least every RING_POLL_TIMEOUT,
+        # then everything they queued is written before the files close
+        for thread in self.threads:
+            thread.join()
+        self.writer.close()
+        for ring in self.rings:
+            ring.close()
+        with open(self.output.replace(".pcap", ".capture.json"), "w") as f:
+            json.dump(self.captureStats(), f, indent=4)
+        self.snifferd = None
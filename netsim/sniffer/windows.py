@@ -0,0 +1,228 @@
+"""Event-triggered capture windows.
+
+A capture block with "windows" only persists packets inside windows
+opened by case events:
+
+    {"on": "start", "node": "client", "after": 10}
+    {"on": "action", "action": "link_down", "before": 2, "after": 5}
+    {"on": "event", "node": "client", "event": "ConnectionTypeChanged", "after": 5}
+    {"on": "log", "node": "server", "pattern": "accepted", "after": 5}
+
+A window spans `before` seconds ahead of its trigger to `after` seconds
+past it, or to the end of the case without `after`. Packets outside all
+windows wait in a pre-trigger buffer long enough to cover the largest
+`before`, and are dropped once they age out of it. The buffer's memory
+is bounded too; packets it evicts early are counted, and windows that
+reach back to them are marked.
+"""
+
+import collections
+import re
+import threading
+
+from mininet.log import error
+
+from util import FileWatcher, LogTailer
+
+TRIGGERS = ("start", "action", "event", "log")
+# Bytes held back per second of the largest `before`, and at most
+PRETRIGGER_BYTES_PER_S = 16 << 20
+PRETRIGGER_MAX_BYTES = 256 << 20
+LOG_POLL_INTERVAL = 0.2
+
+
+def validateWindows(windows, groups):
+    """Raise ValueError for windows that could never open.
+    groups: node group names of the case"""
+    for window in windows:
+        on = window.get("on")
+        if on not in TRIGGERS:
+            raise ValueError(
+                f"Capture window trigger {on!r} must be one of {', '.join(TRIGGERS)}"
+            )
+        node = window.get("node")
+        if on != "action" and node is None:
+            raise ValueError(f"Capture window on {on!r} needs a node group")
+        if node is not None and node not in groups:
+            raise ValueError(f"Capture window node group {node!r} is not in the case")
+        if on == "event" and "event" not in window:
+            raise ValueError("Capture window on 'event' needs an event kind")
+        if on == "log":
+            try:
+                re.compile(window["pattern"])
+            except (KeyError, re.error) as e:
+                raise ValueError(f"Capture window on 'log' needs a valid pattern: {e}")
+        if float(window.get("before", 0)) < 0 or float(window.get("after", 0)) < 0:
+            raise ValueError("Capture window before and after must not be negative")
+
+
+def pretriggerBytes(before):
+    "Memory of a pre-trigger buffer covering `before` seconds"
+    return int(min(max(before, 1) * PRETRIGGER_BYTES_PER_S, PRETRIGGER_MAX_BYTES))
+
+
+def recordSize(record):
+    "Bytes of a record's frame and its viz copy"
+    return len(record[2]) + len(record[4])
+
+
+def windowPattern(window):
+    if window["on"] == "event":
+        return re.compile(r'"kind"\s*:\s*"%s"' % re.escape(window["event"]))
+    return re.compile(window["pattern"])
+
+
+class CaptureGate(object):
+    """Splits captured records into those inside an open window and those
+    held back in case a window opens that reaches back to them.
+
+    Records are Sniffer records: (timestamp ns, interface, frame, wire
+    length, viz frame)."""
+
+    def __init__(self, pretrigger, maxbytes=None):
+        """pretrigger: nanoseconds records are held back for
+        maxbytes: memory of the held back records, derived from
+        pretrigger by default"""
+        self.pretrigger = pretrigger
+        self.maxBytes = maxbytes or pretriggerBytes(pretrigger / 1e9)
+        self.buffer = collections.deque()
+        self.bytes = 0
+        # Records dropped for memory before they aged out, and the
+        # timestamp of the newest of them
+        self.evicted = 0
+        self.evictedUntil = None
+        # Disjoint (start, end) in ns, end None while open ended
+        self.windows = []
+        self.lock = threading.Lock()
+
+    def inWindow(self, ts):
+        for start, end in self.windows:
+            if start <= ts and (end is None or ts <= end):
+                return True
+        return False
+
+    def admit(self, records):
+        "Records to persist now; the others are held back"
+        keep = []
+        with self.lock:
+            for record in records:
+                if self.inWindow(record[0]):
+                    keep.append(record)
+                else:
+                    self.buffer.append(record)
+                    self.bytes += recordSize(record)
+            if records:
+                horizon = max(record[0] for record in records) - self.pretrigger
+                while self.buffer and self.buffer[0][0] < horizon:
+                    self.bytes -= recordSize(self.buffer.popleft())
+            while self.bytes > self.maxBytes:
+                record = self.buffer.popleft()
+                self.bytes -= recordSize(record)
+                self.evicted += 1
+                self.evictedUntil = max(self.evictedUntil or 0, record[0])
+        return keep
+
+    def open(self, start, end):
+        """Open a window; return the held back records that fall inside it,
+        and whether records it reaches back to were evicted"""
+        with self.lock:
+            windows = sorted(self.windows + [(start, end)])
+            merged = [windows[0]]
+            for s, e in windows[1:]:
+                last_s, last_e = merged[-1]
+                if last_e is None or s <= last_e:
+                    end_ = None if e is None or last_e is None else max(e, last_e)
+                    merged[-1] = (last_s, end_)
+                else:
+                    merged.append((s, e))
+            self.windows = merged
+
+            keep, held = [], collections.deque()
+            for record in self.buffer:
+                ts = record[0]
+                if start <= ts and (end is None or ts <= end):
+                    keep.append(record)
+                    self.bytes -= recordSize(record)
+                else:
+                    held.append(record)
+            self.buffer = held
+            truncated = self.evictedUntil is not None and start <= self.evictedUntil
+        return keep, truncated
+
+
+class CaptureTriggers(object):
+    """Opens the sniffer's capture windows when their events happen.
+
+    Launches and scheduled actions are reported by the case runner through
+    started() and action(); node logs are followed on a thread for
+    "event" and "log" windows."""
+
+    def __init__(self, sniffer, windows, nodes, prefix, runner_id):
+        self.sniffer = sniffer
+        self.windows = windows
+        self.stopEvent = threading.Event()
+        self.thread = None
+        self.tailers = []
+        counts = {node["name"]: int(node["count"]) for node in nodes}
+        for window in windows:
+            if window["on"] not in ("event", "log"):
+                continue
+            pattern = windowPattern(window)
+            for i in range(counts[window["node"]]):
+                node_name = f'{window["node"]}_{i}_r{runner_id}'
+                path = f"logs/{prefix}__{node_name}.txt"
+                self.tailers.append((window, pattern, node_name, LogTailer(path)))
+
+    def fire(self, window, reason):
+        after = window.get("after")
+        self.sniffer.trigger(
+            reason,
+            float(window.get("before", 0)),
+            None if after is None else float(after),
+        )
+
+    def started(self, group):
+        for window in self.windows:
+            if window["on"] == "start" and window["node"] == group:
+                self.fire(window, f"start {group}")
+
+    def action(self, node_name, action):
+        group = node_name.rsplit("_", 2)[0]
+        for window in self.windows:
+            if window["on"] != "action":
+                continue
+            if window.get("action", action["action"]) != action["action"]:
+                continue
+            if window.get("node", group) != group:
+                continue
+            self.fire(window, f"{action['action']} {node_name}")
+
+    def begin(self):
+        if not self.tailers:
+            return
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        watcher = FileWatcher([tailer.path for _, _, _, tailer in self.tailers])
+        try:
+            while not self.stopEvent.is_set():
+                for window, pattern, node_name, tailer in self.tailers:
+                    try:
+                        lines = tailer.read_lines()
+                    except OSError as e:
+                        error(f"Capture trigger could not read {tailer.path}: {e}\n")
+                        continue
+                    for line in lines:
+                        if pattern.search(line):
+                            what = window.get("event") or window["pattern"]
+                            self.fire(window, f"{what} {node_name}")
+                watcher.wait(LOG_POLL_INTERVAL)
+        finally:
+            watcher.close()
+
+    def stop(self):
+        self.stopEvent.set()
+        if self.thread:
+            self.thread.join()
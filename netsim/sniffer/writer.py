@@ -0,0 +1,164 @@
+"""Capture output, written off the capture threads.
+
+Capture threads hand whole batches of classified packets to a
+CaptureWriter through a queue bounded by the bytes it holds; its thread
+encodes each batch into one buffer per output and writes it with a
+single call. When the queue is full, capture threads wait and the
+kernel ring absorbs the burst, or counts the drops.
+"""
+
+import collections
+import os
+import threading
+import time
+
+from mininet.log import error
+
+from sniffer.pcap import FORMATS, PcapngWriter, PcapWriter
+
+WRITE_BUFFER = 1 << 20
+# Frame bytes (capture and viz copy) queued at most
+QUEUE_BYTES = 64 << 20
+
+
+class RotatingWriter(object):
+    """pcap or pcapng output that optionally rotates.
+
+    Without rotation everything goes to path. With rotate_bytes or
+    rotate_seconds, output goes to numbered files next to it (x.pcap
+    becomes x.00000.pcap, x.00001.pcap, ...) and only the newest `files`
+    of them are kept, if set."""
+
+    def __init__(
+        self, path, fmt="pcap", snaplen=65535, rotate_bytes=0, rotate_seconds=0, files=0
+    ):
+        if fmt not in FORMATS:
+            raise ValueError(
+                f"Unknown capture format {fmt!r}, expected one of {', '.join(FORMATS)}"
+            )
+        self.base = os.path.splitext(path)[0]
+        self.fmt = fmt
+        self.snaplen = snaplen
+        self.rotateBytes = rotate_bytes
+        self.rotateSeconds = rotate_seconds
+        self.files = files
+        self.rotating = bool(rotate_bytes or rotate_seconds)
+        self.paths = []
+        self.index = 0
+        self.f = None
+        self.open()
+
+    def open(self):
+        suffix = FORMATS[self.fmt]
+        if self.rotating:
+            path = "%s.%05d%s" % (self.base, self.index, suffix)
+            self.index += 1
+        else:
+            path = self.base + suffix
+        self.f = open(path, "wb", buffering=WRITE_BUFFER)
+        cls = PcapngWriter if self.fmt == "pcapng" else PcapWriter
+        self.encoder = cls(self.f, self.snaplen)
+        self.opened = time.monotonic()
+        self.size = 0
+        self.paths.append(path)
+        if self.files and len(self.paths) > self.files:
+            os.remove(self.paths.pop(0))
+
+    def due(self):
+        if self.rotateBytes and self.size >= self.rotateBytes:
+            return True
+        return bool(
+            self.rotateSeconds and time.monotonic() - self.opened >= self.rotateSeconds
+        )
+
+    def writeBatch(self, records):
+        """records: iterable of (frame, timestamp ns, wire length, interface)"""
+        chunk = bytearray()
+        for pkt, ts, wirelen, interface in records:
+            if self.rotating and self.due():
+                self.f.write(chunk)
+                chunk = bytearray()
+                self.f.close()
+                self.open()
+            data = self.encoder.record(pkt, ts, wirelen, interface)
+            chunk += data
+            self.size += len(data)
+        self.f.write(chunk)
+
+    def close(self):
+        self.f.close()
+
+
+class CaptureWriter(object):
+    """Writes batches of (timestamp ns, interface, frame, wire length, viz
+    frame) to the capture and its address-rewritten viz copy."""
+
+    def __init__(self, pcap, viz, maxbytes=QUEUE_BYTES):
+        self.pcap = pcap
+        self.viz = viz
+        self.queue = collections.deque()
+        self.queued = 0
+        self.maxBytes = maxbytes
+        self.cond = threading.Condition()
+        self.written = 0
+        self.failed = None
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @staticmethod
+    def size(batch):
+        return sum(len(p[2]) + len(p[4]) for p in batch)
+
+    def put(self, batch, wait=True):
+        """Queue a batch, waiting while the queue is full.
+        Without wait it is queued right away, past the bound: for records
+        already held in memory elsewhere, by callers that must not block"""
+        if not batch:
+            return
+        size = self.size(batch)
+        with self.cond:
+            # A batch larger than the whole queue still goes into an empty one
+            while wait and self.queue and self.queued + size > self.maxBytes:
+                self.cond.wait()
+            self.queue.append((batch, size))
+            self.queued += size
+            self.cond.notify_all()
+
+    def get(self):
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            batch, size = self.queue.popleft()
+            self.queued -= size
+            self.cond.notify_all()
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.get()
+            if batch is None:
+                break
+            if self.failed:
+                continue
+            try:
+                self.pcap.writeBatch((p[2], p[0], p[3], p[1]) for p in batch)
+                self.viz.writeBatch((p[4], p[0], p[3], p[1]) for p in batch)
+            except Exception as e:  # pylint: disable=broad-except
+                # Keep draining so capture threads never block on a dead writer
+                self.failed = str(e)
+                error(f"Capture output failed, dropping packets: {e}\n")
+                continue
+            self.written += len(batch)
+
+    def close(self):
+        "Write out everything queued so far and close the files"
+        with self.cond:
+            self.queue.append((None, 0))
+            self.cond.notify_all()
+        self.thread.join()
+        for output in (self.pcap, self.viz):
+            try:
+                output.close()
+            except OSError as e:
+                error(f"Closing capture output failed: {e}\n")
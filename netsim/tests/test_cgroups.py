@@ -0,0 +1,46 @@
+import os
+import tempfile
+import unittest
+
+from cgroups import RunnerCgroups
+
+
+def fake_root(controllers="cpuset cpu memory"):
+    """A directory laid out like a cgroup v2 mount, without the kernel:
+    groups created below it get cgroup.controllers but no cpuset files."""
+    root = tempfile.mkdtemp()
+    with open(os.path.join(root, "cgroup.controllers"), "w") as f:
+        f.write(controllers)
+    return root
+
+
+class FakeCgroups(RunnerCgroups):
+    "RunnerCgroups on a fake root, where the kernel creates no interface files"
+
+    @staticmethod
+    def enable(path, controllers):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "cgroup.controllers"), "w") as f:
+            f.write("cpuset cpu memory")
+        RunnerCgroups.enable(path, controllers)
+
+
+class AllocationTest(unittest.TestCase):
+    def test_memory_only_allocation(self):
+        cgroups = FakeCgroups(2, memory_max="4G", root=fake_root())
+        allocation = cgroups.allocation(1)
+        self.assertEqual(allocation["memory_max"], "4G")
+        self.assertEqual(allocation["cgroup"], cgroups.path(1))
+        self.assertNotIn("cpus", allocation)
+
+    def test_cpuset_allocation(self):
+        cgroups = FakeCgroups(1, cpuset=True, root=fake_root())
+        # The kernel derives this file from cpuset.cpus
+        path = os.path.join(cgroups.path(0), "cpuset.cpus.effective")
+        with open(path, "w") as f:
+            f.write("0-3")
+        self.assertEqual(cgroups.allocation(0)["cpus"], "0-3")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,4 +1,7 @@
+import ctypes
 import os
+import select
+import time
 
 FAILED_TESTS = []
 
@@ -60,3 +63,95 @@ def eject(_nodes, prefix, _runner_id, temp_dirs):
     write_failure_summary()
     cleanup_tmp_dirs(temp_dirs)
     raise Exception("Netsim run failed: %s" % prefix)
+
+
+class LogTailer:
+    """Follow a growing log file and return only newly appended lines.
+
+    Keeps the byte offset of the last read so every call costs only as much
+    as the data written since, no matter how large the log has grown.
+    Incomplete trailing lines are held back until their newline arrives."""
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.partial = b""
+
+    def read_lines(self):
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+                if size < self.offset:
+                    # File was truncated or replaced, start over
+                    self.offset, self.partial = 0, b""
+                f.seek(self.offset)
+                data = f.read(size - self.offset)
+        except FileNotFoundError:
+            return []
+        self.offset += len(data)
+        chunks = (self.partial + data).split(b"\n")
+        self.partial = chunks.pop()
+        return [c.decode("utf-8", errors="replace") + "\n" for c in chunks]
+
+
+class FileWatcher:
+    """Block until one of the watched files is written to.
+
+    Uses inotify through libc when available and falls back to sleeping
+    for the poll interval otherwise. Files that do not exist yet are
+    polled until they appear and watched from then on."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+
+    def __init__(self, paths, poll_interval=0.2):
+        self.poll_interval = poll_interval
+        self.fd = -1
+        self.pending = list(paths)
+        try:
+            self.libc = ctypes.CDLL(None, use_errno=True)
+            fd = self.libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError):
+            return
+        if fd < 0:
+            return
+        self.fd = fd
+        self.arm()
+
+    def arm(self):
+        """Add watches for pending paths, return True if any was added."""
+        added = False
+        for path in list(self.pending):
+            wd = self.libc.inotify_add_watch(
+                self.fd, os.fsencode(path), self.IN_MODIFY | self.IN_CLOSE_WRITE
+            )
+            if wd >= 0:
+                self.pending.remove(path)
+                added = True
+        return added
+
+    def wait(self, timeout):
+        """Wait up to timeout seconds for a write event."""
+        if self.fd < 0:
+            time.sleep(min(timeout, self.poll_interval))
+            return
+        if self.pending:
+            # Writes before the watch existed were not seen, let the
+            # caller read a file that just appeared right away
+            if self.arm():
+                return
+            if self.pending:
+                timeout = min(timeout, self.poll_interval)
+        ready, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if ready:
+            try:
+                while os.read(self.fd, 4096):
+                    pass
+            except BlockingIOError:
+                pass
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1